@@ -0,0 +1,306 @@
+"""
+    bench.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import sys
+import json
+import atexit
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="titan_bench_")
+atexit.register(shutil.rmtree, WORK_DIR, True)
+
+# Titan keeps its files next to sys.argv[0], point that at a scratch directory
+# before anything from titan is imported.
+sys.argv[0] = os.path.join(WORK_DIR, "bench")
+sys.path.insert(0, REPO_DIR)
+
+from titan import globals as titan_globals
+from titan.host import Host
+from titan.runner import Runner
+from titan.journal import Journal
+from titan.registry import EntryRegistry
+from titan.gui import filehandler
+from titan.gui.titanentry import TitanEntry
+
+SIZES = (100, 10000, 100000)
+WIDTHS = (1, 8, 32)
+DEPTHS = (1, 4, 16)
+REPEAT = 5
+THRESHOLD = 0.20    # slower than the baseline by more than this is a regression
+STARTUP_TIMEOUT = 30    # seconds to wait for the GUI's --profile-startup file
+
+# Only needed after the GUI's first paint, importing the GUI must not load them.
+DEFERRED_MODULES = ("titan.updater", "urllib.request", "titan.runner", "titan.history", "sqlite3")
+
+
+class QuietHost(Host):
+    def status(self, msg):
+        pass
+
+    def tick(self, msg):
+        pass
+
+
+def measure(fn, repeat):
+    # best of repeat, the other runs mostly measure noise
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        took = time.perf_counter() - start
+        best = took if best is None else min(best, took)
+    return best
+
+
+def fake_executable():
+    if os.name == "nt":
+        path = os.path.join(WORK_DIR, "fake.bat")
+        with open(path, "w") as fh:
+            fh.write("@exit 0\n")
+        return path
+
+    path = os.path.join(WORK_DIR, "fake.sh")
+    with open(path, "w") as fh:
+        fh.write("#!/bin/sh\nexit 0\n")
+    os.chmod(path, 0o755)
+    return path
+
+
+def fake_copy(fake, name):
+    # the planner treats processes with the same path as one, every node gets its own copy
+    path = os.path.join(WORK_DIR, name + os.path.splitext(fake)[1])
+    shutil.copy2(fake, path)
+    return path
+
+
+def synthetic_entries(count, seed=1):
+    rng = random.Random(seed)
+    entries = []
+    for i in range(count):
+        location = os.path.join(WORK_DIR, "games", f"game_{i}", f"game_{i}.exe")
+        arguments = [f"--option-{j}" for j in range(rng.randint(0, 3))]
+        preloads = [os.path.join(WORK_DIR, "tools", f"tool_{rng.randint(0, 50)}.exe") for _ in range(rng.randint(0, 2))]
+        entries.append(TitanEntry(f"Game {i}", location, rng.uniform(0, 360000), rng.randint(0, 500), preloads, arguments))
+    return entries
+
+
+def bench_config(sizes, repeat, results):
+    for size in sizes:
+        registry = EntryRegistry(synthetic_entries(size))
+        results[f"save_entries_{size}"] = measure(lambda: filehandler.save_entries(registry), repeat)
+        results[f"load_file_{size}"] = measure(lambda: filehandler.load_file(titan_globals.CONFIG_FILE), repeat)
+        results[f"load_cached_{size}"] = measure(lambda: filehandler.load_cached(), repeat)
+        print(f"config: {size} entries done", file=sys.stderr)
+
+
+async def launch_once(host, entry):
+    entry_runner = Runner(host, entry)
+    entry_runner.run()
+    await entry_runner.launch
+    took = time.perf_counter() - entry_runner.launch_start
+    if entry_runner.watch is not None:
+        await entry_runner.watch
+    return took
+
+
+def launch_host(entries):
+    host = QuietHost(EntryRegistry(entries), Journal(os.path.join(WORK_DIR, "bench.journal")))
+    host.sample_resources = False
+    host.track_process_tree = False
+    return host
+
+
+def bench_launch(widths, depths, repeat, results):
+    fake = fake_executable()
+    loop = asyncio.get_event_loop()
+
+    # one entry with width preloads, all started side by side
+    for width in widths:
+        preloads = [fake_copy(fake, f"preload_{i}") for i in range(width)]
+
+        entry = TitanEntry("Wide", fake, 0, 0, preloads, [])
+        host = launch_host([entry])
+        results[f"launch_width_{width}"] = min(loop.run_until_complete(launch_once(host, entry)) for _ in range(repeat))
+        print(f"launch: width {width} done", file=sys.stderr)
+
+    # a chain of depth entries, each started through ENT[...] from the one before
+    for depth in depths:
+        entries = []
+        for i in range(depth):
+            preloads = [f"ENT[Chain {i + 1}]"] if i + 1 < depth else []
+            entries.append(TitanEntry(f"Chain {i}", fake_copy(fake, f"chain_{i}"), 0, 0, preloads, []))
+
+        host = launch_host(entries)
+        results[f"launch_depth_{depth}"] = min(loop.run_until_complete(launch_once(host, entries[0])) for _ in range(repeat))
+        print(f"launch: depth {depth} done", file=sys.stderr)
+
+
+def bench_import(repeat, results):
+    # interpreter startup alone, then with each module, the difference is Titan's share
+    def run(code):
+        return lambda: subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True)
+
+    bare = measure(run("pass"), repeat)
+    results["import_cli"] = max(0.0, measure(run("import titan.entrypoints.titan_cli"), repeat) - bare)
+    results["import_runner"] = max(0.0, measure(run("import titan.runner"), repeat) - bare)
+    print("imports done", file=sys.stderr)
+
+
+def has_wx():
+    return subprocess.run([sys.executable, "-c", "import wx, wxasync"], cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+
+def deferred_loaded(module):
+    code = f"import sys, json, {module}; print(json.dumps([name for name in {DEFERRED_MODULES!r} if name in sys.modules]))"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(proc.stdout)
+
+
+def profile_gui():
+    # starts the GUI in the scratch directory and closes it once it has written its --profile-startup file
+    path = os.path.join(WORK_DIR, "startup.json")
+    if os.path.exists(path):
+        os.remove(path)
+
+    code = f"import sys; sys.argv[0] = {sys.argv[0]!r}; from titan.entrypoints import titan_gui; titan_gui.main()"
+    proc = subprocess.Popen([sys.executable, "-c", code, f"--profile-startup={path}"], cwd=REPO_DIR)
+    try:
+        deadline = time.perf_counter() + STARTUP_TIMEOUT
+        while time.perf_counter() < deadline and proc.poll() is None:
+            try:
+                with open(path, "r") as fh:
+                    return json.load(fh)
+            except (OSError, ValueError):
+                time.sleep(0.05)    # not written yet, or only half of it
+        raise RuntimeError(f"the GUI didn't write '{path}' within {STARTUP_TIMEOUT}s")
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def bench_startup(repeat, results):
+    # returns what broke, on top of the timings going through the usual baseline comparison
+    failures = []
+    loaded = deferred_loaded("titan.entrypoints.titan_cli")
+    if len(loaded) > 0:
+        failures.append(f"importing the CLI loads {', '.join(loaded)}, only the commands that need them should")
+
+    if not has_wx():
+        print("startup: wx/wxasync aren't installed, only the CLI's imports were checked", file=sys.stderr)
+        return failures
+
+    loaded = deferred_loaded("titan.entrypoints.titan_gui")
+    if len(loaded) > 0:
+        failures.append(f"importing the GUI loads {', '.join(loaded)}, they should wait for the first paint")
+
+    bare = measure(lambda: subprocess.run([sys.executable, "-c", "pass"], cwd=REPO_DIR, check=True), repeat)
+    took = measure(lambda: subprocess.run([sys.executable, "-c", "import titan.entrypoints.titan_gui"], cwd=REPO_DIR, check=True), repeat)
+    results["import_gui"] = max(0.0, took - bare)
+
+    # the best run of every phase, times are from process start
+    for _ in range(repeat):
+        for phase, at in profile_gui().items():
+            name = f"startup_{phase}"
+            results[name] = min(results.get(name, at), at)
+
+    print("startup done", file=sys.stderr)
+    return failures
+
+
+def compare(baseline, results, threshold):
+    regressions = []
+    print(f"{'benchmark':<24} {'baseline (ms)':>14} {'now (ms)':>10} {'change':>8}")
+    for name, took in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<24} {'-':>14} {took * 1000:>10.2f} {'new':>8}")
+            continue
+
+        change = (took - before) / before if before > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<24} {before * 1000:>14.2f} {took * 1000:>10.2f} {change:>+8.0%}{flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times Titan's config I/O, launch chains and imports.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="library sizes, comma separated")
+    parser.add_argument("--widths", default=",".join(map(str, WIDTHS)), help="preloads per entry, comma separated")
+    parser.add_argument("--depths", default=",".join(map(str, DEPTHS)), help="ENT[...] chain lengths, comma separated")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per benchmark, the best one counts")
+    parser.add_argument("--only", choices=("config", "launch", "import", "startup"), action="append", help="run only these groups")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown before flagging, 0.2 = 20%%")
+    args = parser.parse_args(sys.argv[1:])
+
+    groups = args.only or ("config", "launch", "import", "startup")
+    results = {}
+    failures = []
+    if "config" in groups:
+        bench_config([int(size) for size in args.sizes.split(",")], args.repeat, results)
+    if "launch" in groups:
+        bench_launch([int(width) for width in args.widths.split(",")], [int(depth) for depth in args.depths.split(",")], args.repeat, results)
+    if "import" in groups:
+        bench_import(args.repeat, results)
+    if "startup" in groups:
+        failures.extend(bench_startup(args.repeat, results))
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump({
+                "titan": titan_globals.VERSION,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results
+            }, fh, indent=4)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r") as fh:
+            baseline = json.load(fh)["results"]
+
+    regressions = compare(baseline, results, args.threshold)
+    if len(regressions) > 0:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+
+    for failure in failures:
+        print(f"\nFAILED: {failure}")
+
+    return 1 if len(regressions) > 0 or len(failures) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
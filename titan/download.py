@@ -0,0 +1,178 @@
+"""
+    download.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+
+from http.client import HTTPException
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+CHUNK_SIZE = 64 * 1024
+TIMEOUT = 30                # seconds without data before giving up
+CONTENT_RANGE = re.compile(r"bytes (\d+)-\d+/(\d+|\*)")
+SHA256 = re.compile(r"[0-9a-f]{64}")
+MANIFEST_LIMIT = 64 * 1024  # version manifests are tiny, don't read more than this
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_checksum(url, timeout=TIMEOUT):
+    # accepts the usual sha256sum output, "<digest>  <file name>"
+    with urlopen(url, timeout=timeout) as res:
+        fields = res.read(1024).decode("ascii", "replace").split()
+
+    digest = fields[0].lower() if len(fields) > 0 else ""
+    if SHA256.fullmatch(digest) is None:
+        raise ChecksumError(f"No valid checksum published at {url}")
+
+    return digest
+
+
+def _load_check_cache(path):
+    try:
+        with open(path, "r") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_check_cache(path, cache):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as fh:
+        json.dump(cache, fh)
+    os.replace(temp_path, path)
+
+
+def latest_version(url, cache_path, interval, timeout=TIMEOUT):
+    """
+    Returns the "version" field of the JSON manifest at url. The last answer is
+    kept in cache_path: within interval seconds of the last check it's returned
+    without touching the network, after that the manifest is requested with
+    If-None-Match/If-Modified-Since so an unchanged one costs a 304. Blocking.
+    """
+    cache = _load_check_cache(cache_path)
+    if cache.get("version") and 0 <= time.time() - cache.get("checked", 0) < interval:
+        return cache["version"]
+
+    request = Request(url)
+    if cache.get("version") and cache.get("etag"):
+        request.add_header("If-None-Match", cache["etag"])
+    if cache.get("version") and cache.get("last_modified"):
+        request.add_header("If-Modified-Since", cache["last_modified"])
+
+    try:
+        with urlopen(request, timeout=timeout) as res:
+            manifest = json.loads(res.read(MANIFEST_LIMIT).decode("utf-8"))
+            cache = {
+                "version": str(manifest["version"]),
+                "etag": res.headers.get("ETag"),
+                "last_modified": res.headers.get("Last-Modified"),
+            }
+    except HTTPError as err:
+        if err.code != 304 or not cache.get("version"):
+            raise
+
+    cache["checked"] = time.time()
+    try:
+        _save_check_cache(cache_path, cache)
+    except OSError:
+        pass    # checking again next launch is harmless
+
+    return cache["version"]
+
+
+def _open(url, offset, timeout):
+    request = Request(url)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
+
+    try:
+        return urlopen(request, timeout=timeout)
+    except HTTPError as err:
+        # 416 means there's nothing left past the offset, the checksum decides if it's whole
+        if err.code == 416 and offset > 0:
+            return None
+        raise
+
+
+def fetch(url, path, sha256=None, progress=None, chunk_size=CHUNK_SIZE, timeout=TIMEOUT):
+    """
+    Downloads url to path in chunks. Data goes to path + ".part" first so an interrupted
+    download is resumed with a Range request instead of starting over. Blocking, run it
+    in an executor. progress(done, total) is called from the downloading thread, total
+    is None when the server doesn't say.
+    """
+    part = f"{path}.part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+
+    res = _open(url, offset, timeout)
+    if res is not None:
+        with res:
+            total = None
+            if res.status == 206:
+                matches = CONTENT_RANGE.match(res.headers.get("Content-Range", ""))
+                if matches is None or int(matches.group(1)) != offset:
+                    raise OSError(f"Server sent an unexpected range for {url}")
+
+                if matches.group(2) != "*":
+                    total = int(matches.group(2))
+            else:
+                # the server ignored the range, start over
+                offset = 0
+                if res.headers.get("Content-Length") is not None:
+                    total = int(res.headers["Content-Length"])
+
+            done = offset
+            with open(part, "ab" if offset > 0 else "wb") as fh:
+                try:
+                    for chunk in iter(lambda: res.read(chunk_size), b""):
+                        fh.write(chunk)
+                        done += len(chunk)
+                        if progress is not None:
+                            progress(done, total)
+                except HTTPException as err:
+                    raise OSError(f"Download of {url} was interrupted: {err!r}")
+
+            # keep the partial file around, the next call picks up from here
+            if total is not None and done < total:
+                raise OSError(f"Download of {url} was interrupted at {done} of {total} bytes")
+
+    if sha256 is not None and file_sha256(part) != sha256.lower():
+        os.remove(part)
+        raise ChecksumError(f"Checksum mismatch for {url}")
+
+    os.replace(part, path)
+    return path
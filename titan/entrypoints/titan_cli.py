@@ -0,0 +1,201 @@
+"""
+    titan_cli.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import sys
+
+from titan import metrics
+from titan.journal import Journal
+from titan.registry import EntryRegistry
+from titan.globals import CONFIG_FILE, JOURNAL_FILE, STATS_FILE, USAGE, LONG_USAGE, NAME
+from titan.gui import filehandler
+from titan.gui.titanentry import TitanEntry
+
+HISTORY_TOP = 20
+
+# Everything imported here (and by the modules above) must stay free of wx,
+# wxasync and the updater, so the CLI starts in a few tens of milliseconds.
+
+
+def _load(journal):
+    filehandler.init_files()
+    return EntryRegistry(filehandler.load_entries(journal))
+
+
+def _persist(journal):
+    # the journal already holds the change, only fold it in once it's grown.
+    # compact() works from the files, the GUI may have journaled changes we never loaded
+    if journal.needs_compaction():
+        try:
+            filehandler.compact(journal)
+        except OSError as err:
+            print(f"Unable to save to file '{CONFIG_FILE}'! Reason: {err}", file=sys.stderr)
+
+
+def _find(registry, title):
+    entry = registry.get_by_title(title)
+    if entry is None:
+        print(f"Entry '{title}' doesn't exist!", file=sys.stderr)
+    return entry
+
+
+def cmd_help(registry, journal, args):
+    print(USAGE)
+    print(LONG_USAGE)
+    return 0
+
+
+def cmd_list(registry, journal, args):
+    for entry in registry:
+        print(entry.title)
+    return 0
+
+
+def cmd_stats(registry, journal, args):
+    if len(args) > 0:
+        entry = _find(registry, " ".join(args))
+        if entry is None:
+            return 1
+        entries = [entry]
+    else:
+        entries = sorted(registry, key=lambda entry: entry.time_played, reverse=True)
+
+    width = max([len(entry.title) for entry in entries] + [5])
+    print(f"{'Title':<{width}}  {'Time Played':>11}  {'Times Opened':>12}")
+    for entry in entries:
+        print(f"{entry.title:<{width}}  {entry.get_time_played():>11}  {entry.times_opened:>12}")
+    return 0
+
+
+def cmd_add(registry, journal, args):
+    # add <title> <location> [arguments...] [-- preloads...]
+    if len(args) < 2:
+        print(f"Usage: {NAME.lower()} add <title> <location> [arguments...] [-- preloads...]", file=sys.stderr)
+        return 1
+
+    title, location, rest = args[0], args[1], args[2:]
+    preloads = []
+    if "--" in rest:
+        split = rest.index("--")
+        rest, preloads = rest[:split], rest[split + 1:]
+
+    if registry.has_title(title):
+        print(f"Entry '{title}' already exists!", file=sys.stderr)
+        return 1
+
+    entry = TitanEntry(title, os.path.normpath(location), 0, 0, preloads, rest)
+    registry.add(entry)
+    journal.put(filehandler.entry_table(entry))
+    _persist(journal)
+    print(f"Added entry '{title}'.")
+    return 0
+
+
+def cmd_run(registry, journal, args):
+    if len(args) <= 0:
+        print(f"Usage: {NAME.lower()} run <game> [--sample-resources]", file=sys.stderr)
+        return 1
+
+    # imported here, nothing else needs the subprocess/asyncio machinery
+    import asyncio
+    from titan import log
+    from titan import sampler
+    from titan.host import Host
+    from titan.sessions import SessionManager
+    from titan.history import SessionHistory
+
+    entry = _find(registry, " ".join(arg for arg in args if arg != sampler.FLAG))
+    if entry is None:
+        return 1
+
+    log.setup()
+    history = SessionHistory(STATS_FILE)
+    host = Host(registry, journal, history)
+    host.sample_resources = sampler.requested(args)
+
+    async def session():
+        sessions = SessionManager(host)
+        entry_runner = sessions.start(entry)
+        if entry_runner is None:
+            return 1
+
+        await sessions.wait()
+        return 0 if entry_runner.initial_call is not None else 1
+
+    code = asyncio.get_event_loop().run_until_complete(session())
+    history.close()
+    _persist(journal)
+    return code
+
+
+def cmd_history(registry, journal, args):
+    from titan.history import SessionHistory
+
+    try:
+        days = int(args[0]) if len(args) > 0 else 30
+    except ValueError:
+        print(f"Usage: {NAME.lower()} history [days]", file=sys.stderr)
+        return 1
+
+    history = SessionHistory(STATS_FILE)
+    totals = history.top(HISTORY_TOP, days)
+    history.close()
+
+    width = max([len(title) for title, _, _ in totals] + [5])
+    print(f"{'Title':<{width}}  {'Hours':>8}  {'Sessions':>8}")
+    for title, seconds, sessions in totals:
+        print(f"{title:<{width}}  {seconds / 3600:>8.1f}  {sessions:>8}")
+    return 0
+
+
+COMMANDS = {
+    "help": cmd_help,
+    "list": cmd_list,
+    "stats": cmd_stats,
+    "add": cmd_add,
+    "run": cmd_run,
+    "history": cmd_history,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    metrics_path, metrics_port = metrics.requested(argv)
+    argv = [arg for arg in argv if not metrics.is_flag(arg)]
+    if len(argv) <= 0 or argv[0] not in COMMANDS:
+        print(USAGE, file=sys.stderr)
+        return 1
+
+    command = COMMANDS[argv[0]]
+    if command is cmd_help:
+        return cmd_help(None, None, argv[1:])
+
+    metrics.export(metrics_path, metrics_port)
+    journal = Journal(JOURNAL_FILE)
+    registry = _load(journal)
+    code = command(registry, journal, argv[1:])
+    metrics.flush()
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,15 +20,17 @@
     See NOTICE.txt for third-party license information.
 """
 
+from titan import startup
+
 import wx
 import sys
-import time
-import asyncio
-import datetime
 
-from titan import runner
-from titan import updater
-from titan.globals import CONFIG_FILE, VERSION, NAME, NAME_LOW
+from titan import log
+from titan import metrics
+from titan import prewarm
+from titan import reporting
+from titan.journal import Journal
+from titan.globals import JOURNAL_FILE, STATS_FILE, VERSION, NAME
 from titan.gui import utils
 from titan.gui import filehandler
 from titan.gui.titanentry import TitanEntry
@@ -36,6 +38,9 @@ from titan.gui.titanentrylist import TitanEntryList
 
 from wxasync import AsyncBind, WxAsyncApp, StartCoroutine
 from asyncio.events import get_event_loop
+from asyncio import ensure_future
+
+startup.mark("import")
 
 
 class TitanFrame(wx.Frame):
@@ -43,12 +48,73 @@ class TitanFrame(wx.Frame):
         super(TitanFrame, self).__init__(*args, **kwargs)
         self.SetIcon(wx.Icon("titan_logo.ico"))
         self.SetMinSize((500, 250))
-        self.entry_is_running = False
-
-        update_manager = updater.Updater(self)
-        StartCoroutine(update_manager.check_for_updates, self)
+        self.sessions = None
+        self.journal = Journal(JOURNAL_FILE)
+        self.history = None     # opened when first needed, see _open_history
+        self.tasks = set()      # from start(), cancelled on exit
+        self.prewarm_on_select = prewarm.requested()
+        self.prewarmer = None
+        self.health = None
+        self.scan_queue = []    # (entries or None for all of them, report)
+        self.scanning = False
+        self.track_process_tree = True
+        self.profile_startup, self.profile_path = startup.requested()
+        self.metrics_path, self.metrics_port = metrics.requested()
 
         self.init_gui()
+        startup.mark("widgets")
+        self.entrylist.Bind(wx.EVT_PAINT, self.OnFirstPaint)
+
+    def OnFirstPaint(self, event):
+        event.Skip()
+        self.entrylist.Unbind(wx.EVT_PAINT, handler=self.OnFirstPaint)
+        startup.mark("first_paint")
+
+        # nothing below is needed to show the library, so it waits for the first frame
+        StartCoroutine(self._check_for_updates, self)
+        self._check_library()
+        self.entrylist.build_index()
+        metrics.export(self.metrics_path, self.metrics_port)
+
+        if self.profile_startup:
+            startup.dump(self.profile_path)
+
+    async def _check_for_updates(self):
+        from titan import updater
+
+        update_manager = updater.Updater(self)
+        await update_manager.check_for_updates()
+
+    def _check_library(self, entries=None, report=False):
+        # None rescans everything, folders that haven't changed come from the cache
+        self.scan_queue.append((entries, report))
+        if not self.scanning:
+            self.scanning = True
+            StartCoroutine(self._scan_library, self)
+
+    async def _scan_library(self):
+        from titan.health import HealthScanner
+
+        if self.health is None:
+            self.health = HealthScanner()
+
+        loop = get_event_loop()
+        try:
+            while len(self.scan_queue) > 0:
+                entries, report = self.scan_queue.pop(0)
+                if entries is None:
+                    entries = list(self.entrylist.entries)
+
+                results = await loop.run_in_executor(None, self.health.scan, entries, self.entrylist.entries.get_by_title)
+                self.entrylist.set_broken(results)
+
+                broken = len(self.entrylist.broken)
+                if broken > 0:
+                    self.SetStatusText(f"{broken} entries have missing files (shown in red)")
+                elif report:
+                    self.SetStatusText("All entries found!")
+        finally:
+            self.scanning = False
 
     def init_gui(self):
         panel = wx.Panel(self)
@@ -56,31 +122,19 @@ class TitanFrame(wx.Frame):
         hbox = wx.BoxSizer(wx.HORIZONTAL)
         vbox = wx.BoxSizer(wx.VERTICAL)
 
+        self.search = wx.SearchCtrl(panel, wx.ID_ANY)
+        self.search.ShowCancelButton(True)
         self.entrylist = TitanEntryList(panel)
 
         filehandler.init_files()
-        self.GAMES = filehandler.load_file(CONFIG_FILE)
-
-        for game in self.GAMES:
-            if game == f"{NAME_LOW}_info":
-                continue
+        self.entrylist.add_entries(filehandler.load_entries(self.journal))
+        startup.mark("config")
+        self.writer = filehandler.ConfigWriter(self.journal, on_written=self._sync_stats)
 
-            title = game
-            loc = self.GAMES[game]["location"]
-            args = self.GAMES[game]["arguments"]
-            preloads = self.GAMES[game]["preloads"]
-            time_played = self.GAMES[game]["time_played"]
-            times_opened = self.GAMES[game]["times_opened"]
-
-            self.entrylist.add_entry(TitanEntry(
-                    title,
-                    loc,
-                    time_played,
-                    times_opened,
-                    preloads,
-                    args))
-
-        hbox.Add(self.entrylist, wx.ID_ANY, wx.EXPAND | wx.ALL, 20)
+        list_box = wx.BoxSizer(wx.VERTICAL)
+        list_box.Add(self.search, 0, wx.EXPAND | wx.BOTTOM, 5)
+        list_box.Add(self.entrylist, 1, wx.EXPAND)
+        hbox.Add(list_box, wx.ID_ANY, wx.EXPAND | wx.ALL, 20)
 
         btn_size = (90, 30)
         buttons_panel = wx.Panel(panel)
@@ -88,12 +142,17 @@ class TitanFrame(wx.Frame):
         self.btn_add = wx.Button(buttons_panel, wx.ID_ANY, "Add", size=btn_size)
         self.btn_edit = wx.Button(buttons_panel, wx.ID_ANY, "Edit", size=btn_size)
         self.btn_delete = wx.Button(buttons_panel, wx.ID_ANY, "Delete", size=btn_size)
+        self.btn_check = wx.Button(buttons_panel, wx.ID_ANY, "Check", size=btn_size)
 
         self.Bind(wx.EVT_BUTTON, self.OnStart, id=self.btn_start.GetId())
         self.Bind(wx.EVT_BUTTON, self.OnAdd, id=self.btn_add.GetId())
         self.Bind(wx.EVT_BUTTON, self.OnEdit, id=self.btn_edit.GetId())
         self.Bind(wx.EVT_BUTTON, self.OnDelete, id=self.btn_delete.GetId())
+        self.Bind(wx.EVT_BUTTON, self.OnCheck, id=self.btn_check.GetId())
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.OnSelect)
+        self.search.Bind(wx.EVT_TEXT, self.OnSearch)
+        self.search.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.OnSearchCancel)
+        self.Bind(wx.EVT_CLOSE, self.OnExit)
 
         # disable unusable buttons on start
         self.DisableEditButtons()
@@ -104,6 +163,8 @@ class TitanFrame(wx.Frame):
         vbox.Add(self.btn_add, 0, wx.TOP, 5)
         vbox.Add(self.btn_edit, 0, wx.TOP, 5)
         vbox.Add(self.btn_delete, 0, wx.TOP, 5)
+        vbox.Add((-1, 10))
+        vbox.Add(self.btn_check, 0, wx.TOP, 5)
 
         buttons_panel.SetSizer(vbox)
         hbox.Add(buttons_panel, 0.6, wx.EXPAND | wx.RIGHT, 20)
@@ -112,20 +173,85 @@ class TitanFrame(wx.Frame):
         self.Centre()
         self.CreateStatusBar()
 
-        if len(sys.argv) >= 2 and sys.argv[1] == "updated":
+        if "updated" in sys.argv[1:]:
             self.SetStatusText(f"{NAME} updated successfully!")
         else:
             self.SetStatusText("Initialized successfully!")
 
     def _save_data(self):
-        if len(self.entrylist.entries) <= 0:
-            filehandler.delete_file(CONFIG_FILE)
-            filehandler.init_files()
+        # changes are already in the journal, the config is rewritten in the background
+        self.writer.schedule()
+
+    def _open_history(self):
+        # sqlite and the schema script aren't needed until a session ends
+        from titan.history import SessionHistory
+
+        if self.history is None:
+            self.history = SessionHistory(STATS_FILE)
+        return self.history
+
+    def _sync_stats(self, games):
+        # picks up sessions other Titan processes (`titan run`) journaled while we were open
+        for entry in self.entrylist.entries:
+            fields = games.get(entry.title)
+            if fields is None:
+                continue
 
-        filehandler.save_entries(self.entrylist.entries)
+            if (entry.time_played, entry.times_opened) != (fields["time_played"], fields["times_opened"]):
+                entry.time_played = fields["time_played"]
+                entry.times_opened = fields["times_opened"]
+                self.entrylist.mark_dirty(entry)
+
+        self.entrylist.refresh_entries()
+
+    def _compact_if_needed(self):
+        if self.journal.needs_compaction():
+            self.writer.schedule()
+
+    # Runner host interface, see titan/host.py
+    @property
+    def entries(self):
+        return self.entrylist.entries
+
+    @property
+    def sample_resources(self):
+        # only read once something runs, the sampler imports psutil
+        from titan import sampler
+        return sampler.requested()
+
+    def status(self, msg):
+        self.SetStatusText(msg)
+
+    def tick(self, msg):
+        self.SetStatusText(msg)
+
+    def start(self, coro_fn):
+        # StartCoroutine doesn't hand back its task, runners and the session manager await theirs
+        task = ensure_future(coro_fn())
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Task failed", task=repr(task), error=repr(task.exception()))
+
+    def session_ended(self, runner):
+        self.writer.record(self.journal.played, runner.initial_entry.title, runner.get_duration())
+        self._open_history().record_run(runner)
+        self.entrylist.mark_dirty(runner.initial_entry)
+        self.entrylist.refresh_entries()
+        self._compact_if_needed()
+
+    def _update_start_button(self):
+        # several entries can run at once, just not the same one twice
+        entry = self.entrylist.selected_entry()
+        running = self.sessions is not None and entry is not None and self.sessions.is_running(entry)
+        self.btn_start.Enable(entry is not None and not running)
 
     def EnableEditButtons(self):
-        self.btn_start.Enable()
+        self._update_start_button()
         self.btn_edit.Enable()
         self.btn_delete.Enable()
 
@@ -138,54 +264,93 @@ class TitanFrame(wx.Frame):
         selection = self.entrylist.GetFocusedItem()
         if selection != -1:
             self.EnableEditButtons()
+            entry = self.entrylist.selected_entry()
+            problems = self.entrylist.problems(entry)
+            if len(problems) > 0:
+                self.SetStatusText(f"{entry.title}: {'; '.join(problems)}")
+            self._prewarm(entry)
+
+    def OnSearch(self, event):
+        # filtering drops the selection, the buttons follow it
+        self.entrylist.set_filter(self.search.GetValue())
+        self.DisableEditButtons()
+
+    def OnSearchCancel(self, event):
+        self.search.SetValue("")
 
-    async def _disable_if_running(self):
-        while True:
-            if self.entry_runner.running:
-                self.btn_start.Disable()
-            else:
-                self.btn_start.Enable()
-                break
-            await asyncio.sleep(1)
+    def _prewarm(self, entry):
+        if not self.prewarm_on_select or entry is None:
+            return
+
+        # cancels whatever the previous selection was still reading
+        if self.prewarmer is None:
+            self.prewarmer = prewarm.Prewarmer()
+        self.prewarmer.start(entry, self.entrylist.entries.get_by_title)
 
     def OnStart(self, event):
-        selection = self.entrylist.GetFocusedItem()
-        entry = self.entrylist.entries[selection]
+        from titan.sessions import SessionManager
 
-        if selection == -1:
+        entry = self.entrylist.selected_entry()
+
+        if entry is None:
             utils.warning_dialog(f"Unable to load selection! Does it exist?")
+            return
 
-        self.SetStatusText(f"Starting {entry.title}...")
-        self.entry_is_running = True
+        if self.sessions is None:
+            self.sessions = SessionManager(self, on_change=self._update_start_button)
 
-        self.entry_runner = runner.Runner(self, entry)
-        self.entry_runner._log(f"\n[{NAME} Run - {datetime.datetime.now()}]", False)
-        self.entry_runner.run()
+        self.SetStatusText(f"Starting {entry.title}...")
+        self.sessions.start(entry)
 
     def OnAdd(self, event):
-        self.entrylist.add_entry(TitanEntry("New Game"))
-        newest_index = len(self.entrylist.entries) - 1
-        self.entrylist.edit_entry(newest_index)
+        # the new entry would be hidden by the current search
+        if self.search.GetValue() != "":
+            self.search.SetValue("")
+        entry = TitanEntry(self.entrylist.entries.unique_title("New Game"))
+        self.entrylist.add_entry(entry)
+        self.entrylist.edit_entry(entry)
+        self.writer.record(self.journal.put, filehandler.entry_table(entry))
         self._save_data()
+        self._check_library([entry])
 
     def OnEdit(self, event):
-        selection = self.entrylist.GetFocusedItem()
-        if selection != -1:
-            self.entrylist.edit_entry(selection)
+        entry = self.entrylist.selected_entry()
+        if entry is not None:
+            old_title = entry.title
+            self.entrylist.edit_entry(entry)
             self.EnableEditButtons()
+            self.writer.record(self.journal.put, filehandler.entry_table(entry), old_title)
+            if entry.title != old_title:
+                self._open_history().rename(old_title, entry.title)
             self._save_data()
+            # a new title can fix or break other entries' ENT[...] preloads
+            self._check_library(None if entry.title != old_title else [entry])
 
     def OnDelete(self, event):
-        self.entrylist.delete_entry(event)
+        entry = self.entrylist.delete_entry(event)
 
         if len(self.entrylist.entries) <= 0:
             self.DisableEditButtons()
 
-        self._save_data()
+        if entry is not None:
+            self.writer.record(self.journal.delete, entry)
+            self._save_data()
+            self._check_library()
+
+    def OnCheck(self, event):
+        self.SetStatusText("Checking library...")
+        self._check_library(report=True)
 
     def OnExit(self, event):
-        self._save_data()
-        self.Close(True)
+        self.writer.close()
+        if self.history is not None:
+            self.history.close()
+        if self.prewarmer is not None:
+            self.prewarmer.close()
+        metrics.flush()
+        for task in list(self.tasks):
+            task.cancel()
+        self.Destroy()
 
     def OnAbout(self, event):
         wx.MessageBox("This is a wxPython Hello World sample",
@@ -195,6 +360,10 @@ class TitanFrame(wx.Frame):
 
 def main():
     app = WxAsyncApp()
+    reporting.install(warning=utils.warning_dialog, error=utils.error_dialog)
+    # before the frame, so startup work (health scan, scheduling) is logged too.
+    # Records are written on the writer's own thread, this only starts it
+    log.setup()
     frame = TitanFrame(None, title=f"{NAME} {VERSION}")
     frame.Show()
     app.SetTopWindow(frame)
@@ -27,10 +27,22 @@ NAME = "Titan"
 NAME_LOW = NAME.lower()
 VERSION = "0.11"
 
-USAGE = f"{NAME} v{VERSION}\nUsage: {NAME_LOW} (help|add|list|stats) [game]"
-LONG_USAGE = ""
+USAGE = f"{NAME} v{VERSION}\nUsage: {NAME_LOW} (help|add|list|stats|run|history) [game]"
+LONG_USAGE = """
+Commands:
+    help                                    Show this message.
+    list                                    List the title of every entry.
+    stats [game]                            Show playtime for every entry, or just [game].
+    add <title> <location> [args] [-- pre]  Add an entry, with optional arguments and preloads.
+    run <game> [--sample-resources]         Start an entry (and its preloads) and track it until it exits.
+    history [days]                          Show the most played entries over the last [days] (default 30)."""
 
 WORKING_DIR = os.path.dirname(sys.argv[0])
 CONFIG_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_games.toml")
-STATS_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_stats.toml")
+CACHE_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_games.cache")
+JOURNAL_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_games.journal")
+STATS_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_stats.db")
 LOG_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}.log")
+RESOURCES_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_resources.jsonl")
+UPDATE_CACHE_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_update.json")
+METRICS_FILE = os.path.join(WORKING_DIR, f"{NAME_LOW}_metrics.prom")
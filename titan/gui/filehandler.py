@@ -23,26 +23,37 @@
 import os
 import sys
 import toml
-import inspect
+import pickle
+import hashlib
 
-from titan.gui import utils
-from titan.globals import CONFIG_FILE, LOG_FILE, VERSION, NAME, NAME_LOW
+from titan import metrics
+from titan import reporting
+from titan import scheduling
+from titan.gui.titanentry import TitanEntry
+from titan.journal import replay
+from titan.globals import CONFIG_FILE, CACHE_FILE, VERSION, NAME, NAME_LOW
+
+WRITE_DELAY = 2.0          # seconds
+WRITE_MAX_DELAY = 10.0
+CACHE_FORMAT = f"{VERSION}/1"
 
 TITAN_INFO_COMMENT = f" # Internal toml object used by {NAME}. Editing is not recommended."
-TITAN_INFO_RAW = toml.dumps({f"{NAME_LOW}_info": {"cfg_version": VERSION}})
-TITAN_TABLE_HEADER = TITAN_INFO_RAW.split()[0]
-TITAN_INFO = TITAN_TABLE_HEADER + TITAN_INFO_COMMENT + TITAN_INFO_RAW[len(TITAN_TABLE_HEADER):]
 
 
-def init_files():
-    if os.path.exists(LOG_FILE):
-        try:
-            # if log file is more than 5 MB, clear it
-            if os.path.getsize(LOG_FILE) >= 5000000:
-                open(LOG_FILE, "w").close()
-        except OSError as err:
-            print("Unable to write to log file '{LOG_FILE}'! Do you have the correct permissions?")
+def titan_info_table(journal_seq=0):
+    return {"cfg_version": VERSION, "journal_seq": journal_seq}
+
+
+def titan_info(journal_seq=0):
+    raw = toml.dumps({f"{NAME_LOW}_info": titan_info_table(journal_seq)})
+    header = raw.split()[0]
+    return header + TITAN_INFO_COMMENT + raw[len(header):]
 
+
+TITAN_INFO = titan_info()
+
+
+def init_files():
     if not os.path.exists(CONFIG_FILE):
         with open(CONFIG_FILE, "a") as cfg_fh:
             cfg_fh.write("# This file may also be edited manually. However, there are a few things to note:\n")
@@ -61,51 +72,349 @@ def init_files():
             cfg_fh.write(TITAN_INFO)
 
 
-def save_entries(entries):
+def entry_table(entry):
+    args_normalized = []
+    preloads_normalized = []
+
+    if len(entry.preloads) > 0:
+        for preload in entry.preloads:
+            preloads_normalized.append(os.path.normpath(preload.strip()))
+
+    if len(entry.arguments) > 0:
+        for argument in entry.arguments:
+            args_normalized.append(argument.strip())
+
+    table = {
+        "time_played": entry.time_played,
+        "times_opened": entry.times_opened,
+        "location": os.path.normpath(entry.location),
+        "arguments": args_normalized,
+        "preloads": preloads_normalized
+        }
+
+    # optional, only written when set so older configs stay as they were
+    if len(entry.prewarm) > 0:
+        table["prewarm"] = list(entry.prewarm)
+
+    for field in scheduling.ALL_FIELDS:
+        if field in entry.scheduling:
+            table[field] = entry.scheduling[field]
+
+    return {entry.title: table}
+
+
+def dump_tables(tables, journal_seq=0):
+    chunks = [titan_info(journal_seq)]
+    for table in tables:
+        chunks.append("\n")
+        chunks.append(toml.dumps(table))
+
+    return "".join(chunks)
+
+
+def merge_tables(tables):
+    games = {}
+    for table in tables:
+        games.update(table)
+
+    return games
+
+
+def write_config(text, f=CONFIG_FILE):
+    # write next to the config and swap it in, so a crash never leaves half a file
+    raw = text.encode("utf-8")
+    temp_file = f + ".tmp"
+    with open(temp_file, "wb") as cfg_fh:
+        cfg_fh.write(raw)
+        cfg_fh.flush()
+        os.fsync(cfg_fh.fileno())
+    os.replace(temp_file, f)
+    return raw
+
+
+def _cache_key(f, raw=None):
+    st = os.stat(f)
+    key = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": None}
+    if raw is not None:
+        key["sha1"] = hashlib.sha1(raw).hexdigest()
+    return key
+
+
+def save_cache(key, games, info, cache=CACHE_FILE):
+    # the cache is only an optimization, failing to write it is never fatal
+    temp_file = cache + ".tmp"
     try:
-        with open(CONFIG_FILE, "w") as cfg_fh:
-            cfg_fh.write(TITAN_INFO)
-            for entry in entries:
-                args_normalized = []
-                preloads_normalized = []
-
-                if len(entry.preloads) > 0:
-                    for preload in entry.preloads:
-                        preloads_normalized.append(os.path.normpath(preload.strip()))
-
-                if len(entry.arguments) > 0:
-                    for argument in entry.arguments:
-                        args_normalized.append(argument.strip())
-
-                cfg_fh.write("\n")
-                toml.dump({entry.title: {
-                    "time_played": entry.time_played,
-                    "times_opened": entry.times_opened,
-                    "location": os.path.normpath(entry.location),
-                    "arguments": args_normalized,
-                    "preloads": preloads_normalized
-                    }}, cfg_fh)
+        with open(temp_file, "wb") as cache_fh:
+            pickle.dump({"format": CACHE_FORMAT, "key": key, "games": games, "info": info}, cache_fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache)
+    except (OSError, pickle.PicklingError) as err:
+        print(f"Unable to write cache file '{cache}'! Reason: {err}")
+
+
+def _read_cache(f, cache):
+    try:
+        with open(cache, "rb") as cache_fh:
+            snapshot = pickle.load(cache_fh)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get("format") != CACHE_FORMAT:
+        return None
+
+    cached = snapshot["key"]
+    key = _cache_key(f)
+    if key["size"] != cached["size"]:
+        return None
+
+    if key["mtime_ns"] != cached["mtime_ns"]:
+        # touched, but maybe not changed (copied, restored, synced...)
+        with open(f, "rb") as cfg_fh:
+            if hashlib.sha1(cfg_fh.read()).hexdigest() != cached["sha1"]:
+                return None
+
+        key["sha1"] = cached["sha1"]
+        save_cache(key, snapshot["games"], snapshot["info"], cache)
+
+    return snapshot["games"], snapshot["info"]
+
+
+@metrics.CONFIG_SECONDS.time(op="load_cached")
+def load_cached(f=CONFIG_FILE, cache=CACHE_FILE):
+    # skip the toml parse entirely unless the file was changed outside of Titan
+    snapshot = _read_cache(f, cache)
+    if snapshot is not None:
+        return snapshot
+
+    with open(f, "rb") as cfg_fh:
+        raw = cfg_fh.read()
+
+    games, info = load_file(f, with_info=True)
+    save_cache(_cache_key(f, raw), games, info, cache)
+    return games, info
+
+
+@metrics.CONFIG_SECONDS.time(op="save_entries")
+def save_entries(registry, journal_seq=0):
+    try:
+        tables = [entry_table(entry) for entry in registry]
+        raw = write_config(dump_tables(tables, journal_seq))
+        save_cache(_cache_key(CONFIG_FILE, raw), merge_tables(tables), titan_info_table(journal_seq))
     except PermissionError as err:
-        utils.warning_dialog(f"Unable to save to file '{CONFIG_FILE}'!\nReason: {err.strerror} [{err.errno}]")
-        return
+        reporting.warning(f"Unable to save to file '{CONFIG_FILE}'!\nReason: {err.strerror} [{err.errno}]")
+        return False
+
+    return True
+
+
+@metrics.CONFIG_SECONDS.time(op="compact")
+def compact(journal, f=CONFIG_FILE, cache=CACHE_FILE):
+    """
+    Folds the journal into the config. Works from the files rather than from
+    one process's library, so changes journaled by another Titan process (a
+    hotkey `titan run` while the GUI is open) are kept. Only one process
+    compacts at a time. Returns the merged games and the journal_seq they
+    contain.
+    """
+    with journal.compact_lock:
+        with journal.lock:
+            games, info = load_cached(f, cache)
+            replay(games, journal.load(info.get("journal_seq", 0)))
+            journal_seq = journal.seq
+
+        # appends carry on meanwhile, they're numbered past journal_seq and survive the trim
+        text = dump_tables([{title: fields} for title, fields in games.items()], journal_seq)
+
+        with journal.lock:
+            raw = write_config(text, f)
+            save_cache(_cache_key(f, raw), games, titan_info_table(journal_seq), cache)
+            journal.truncate(journal_seq)
+
+    return games, journal_seq
+
+
+class ConfigWriter():
+    """
+    Rewrites the config in the background. Calls to schedule() within
+    `delay` seconds of each other are coalesced into a single write, and a
+    write is never held back longer than `max_delay` by a steady stream of
+    changes. Every change is journaled first, so the write itself is a
+    compact() on a single worker thread and writes never overlap.
+    on_written gets the merged games on the UI thread, for stats other
+    processes added.
+
+    record() journals a change on that same thread, in order with the
+    writes, so the UI never waits on the journal's lock or fsync while
+    another process (or this one) is compacting.
+    """
+    def __init__(self, journal, on_written=None, delay=WRITE_DELAY, max_delay=WRITE_MAX_DELAY, f=CONFIG_FILE, cache=CACHE_FILE):
+        self.journal = journal
+        self.on_written = on_written
+        self.delay = delay
+        self.max_delay = max_delay
+        self.file = f
+        self.cache = cache
+        self.dirty = False
+        self._first_change = None
+        self._handle = None
+        self._pending = None
+        self._records = set()   # journal appends that haven't run yet
+        self._executor = None
+
+    # asyncio/concurrent.futures are imported lazily, the CLI never needs them
+    # for list/stats and they're the bulk of its import time
+
+    def schedule(self):
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        self.dirty = True
+
+        if self._first_change is None:
+            self._first_change = now
+
+        if self._handle is not None:
+            self._handle.cancel()
+
+        delay = min(self.delay, max(0, self._first_change + self.max_delay - now))
+        self._handle = loop.call_later(delay, self._submit)
+
+    @metrics.CONFIG_SECONDS.time(op="write")
+    def _write(self):
+        return compact(self.journal, self.file, self.cache)
+
+    def _run(self, done, fn, *args):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="config-writer")
+
+        fut = self._executor.submit(fn, *args)
+        loop = asyncio.get_event_loop()
+        fut.add_done_callback(lambda fut: loop.call_soon_threadsafe(done, fut))
+        return fut
 
+    def record(self, append, *args):
+        # e.g. record(journal.put, table), arguments are taken now, not when it runs
+        fut = self._run(self._recorded, append, *args)
+        self._records.add(fut)
+        return fut
 
-def load_file(f):
+    def _recorded(self, fut):
+        self._records.discard(fut)
+        err = fut.exception()
+        if err is not None:
+            reporting.warning(f"Unable to save to file '{self.journal.path}'!\nReason: {err}")
+
+    def _submit(self):
+        self._handle = None
+        self._first_change = None
+        self.dirty = False
+
+        self._pending = self._run(self._written, self._write)
+        return self._pending
+
+    def _written(self, fut):
+        err = fut.exception()
+        if err is not None:
+            reporting.warning(f"Unable to save to file '{self.file}'!\nReason: {err}")
+            return
+
+        games, journal_seq = fut.result()
+        # anything journaled here since would be missing from games, the next write brings it
+        if self.on_written is not None and self.journal.seq == journal_seq and len(self._records) <= 0:
+            self.on_written(games)
+
+    def flush(self):
+        # blocks until everything scheduled so far is on disk
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if self.dirty:
+            self._submit()
+
+        for fut in list(self._records) + [self._pending]:
+            if fut is None:
+                continue
+            try:
+                fut.result()
+            except OSError:
+                return False
+
+        return True
+
+    def close(self):
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+        # session ends are only journaled, fold them in so the config is current once Titan exits
+        try:
+            if self.journal.has_changes():
+                self._write()
+        except OSError as err:
+            reporting.warning(f"Unable to save to file '{self.file}'!\nReason: {err}")
+
+
+@metrics.CONFIG_SECONDS.time(op="load_file")
+def load_file(f, with_info=False):
     try:
         file = toml.load(f)
-        del file[f"{NAME_LOW}_info"]
+        info = file.pop(f"{NAME_LOW}_info")
+        if with_info:
+            return file, info
         return file
     except toml.TomlDecodeError as err:
         if "already exists" in err.msg:
-            utils.error_dialog(f"Entry '{str(err.msg).split()[1]}' already exists in file '{f}'!")
+            reporting.error(f"Entry '{str(err.msg).split()[1]}' already exists in file '{f}'!")
         else:
-            utils.error_dialog(f"Formatting error in file '{f}'!\nReason: {err.msg}")
+            reporting.error(f"Formatting error in file '{f}'!\nReason: {err.msg}")
     except:
-        utils.error_dialog(f"Unable to load file '{f}'!\nReason: {sys.exc_info()[0]}")
+        reporting.error(f"Unable to load file '{f}'!\nReason: {sys.exc_info()[0]}")
+
+
+@metrics.CONFIG_SECONDS.time(op="load_library")
+def load_library(journal):
+    # the config and journal are swapped together under the lock, read them the same way
+    with journal.lock:
+        games, info = load_cached()
+        records = journal.load(info.get("journal_seq", 0))
+    return replay(games, records)
+
+
+def load_entries(journal):
+    games = load_library(journal)
+    entries = []
+    for game in games:
+        if game == f"{NAME_LOW}_info":
+            continue
+
+        title = game
+        loc = games[game]["location"]
+        args = games[game]["arguments"]
+        preloads = games[game]["preloads"]
+        time_played = games[game]["time_played"]
+        times_opened = games[game]["times_opened"]
+        prewarm = games[game].get("prewarm", [])
+        settings = {field: games[game][field] for field in scheduling.ALL_FIELDS if field in games[game]}
+
+        entries.append(TitanEntry(
+                title,
+                loc,
+                time_played,
+                times_opened,
+                preloads,
+                args,
+                prewarm,
+                settings))
+
+    return entries
 
 
 def delete_file(f):
     try:
         os.remove(f)
     except OSError as err:
-        utils.error_dialog(f"Unable to remove file '{f}'!\nReason: {err.strerror} [{err.errno}]")
+        reporting.error(f"Unable to remove file '{f}'!\nReason: {err.strerror} [{err.errno}]")
@@ -23,6 +23,8 @@
 import os
 import wx
 from wx.adv import EditableListBox
+from titan import scheduling
+from titan.gui import utils
 
 
 class TitanEditModal(wx.Dialog):
@@ -32,7 +34,7 @@ class TitanEditModal(wx.Dialog):
         self.hasEdited = False
 
         self.init_modal()
-        self.SetSize((350, 450))
+        self.SetSize((350, 540))
         self.SetTitle(f"Editing: {self.entry.title}")
 
     def init_modal(self):
@@ -90,6 +92,39 @@ class TitanEditModal(wx.Dialog):
         box_proc_sizer.Add(self.proc_listbox, wx.ID_ANY, flag=wx.EXPAND | wx.ALL, border=5)
         editor.SetSizer(box_proc_sizer)
 
+        # Scheduling editor, empty fields keep the system default
+        sched = wx.Panel(self)
+        box_sched = wx.StaticBox(sched, label="Scheduling (Priority -20 to 19, CPUs e.g. 0,2-3)")
+        box_sched_sizer = wx.StaticBoxSizer(box_sched, orient=wx.VERTICAL)
+        sched_grid = wx.FlexGridSizer(3, 4, 5, 5)
+
+        for label in ("", "Priority", "CPUs", "I/O"):
+            sched_grid.Add(wx.StaticText(sched, label=label))
+
+        self.sched_controls = {}
+        for prefix, label in (("", "Game:"), ("preload_", "Preloads:")):
+            nice = self.entry.scheduling.get(f"{prefix}nice")
+            affinity = self.entry.scheduling.get(f"{prefix}affinity")
+            ionice = self.entry.scheduling.get(f"{prefix}ionice", "")
+
+            nice_ctrl = wx.TextCtrl(sched, value="" if nice is None else str(nice), size=(50, -1))
+            affinity_ctrl = wx.TextCtrl(sched, value="" if affinity is None else scheduling.format_cpus(affinity), size=(90, -1))
+            ionice_ctrl = wx.Choice(sched, choices=["", *scheduling.IONICE_CLASSES])
+            ionice_ctrl.SetStringSelection(ionice)
+
+            for ctrl in (nice_ctrl, affinity_ctrl):
+                ctrl.Bind(wx.EVT_TEXT, self.OnEdit)
+            ionice_ctrl.Bind(wx.EVT_CHOICE, self.OnEdit)
+
+            sched_grid.Add(wx.StaticText(sched, label=label), flag=wx.ALIGN_CENTER_VERTICAL)
+            sched_grid.Add(nice_ctrl)
+            sched_grid.Add(affinity_ctrl)
+            sched_grid.Add(ionice_ctrl)
+            self.sched_controls[prefix] = (nice_ctrl, affinity_ctrl, ionice_ctrl)
+
+        box_sched_sizer.Add(sched_grid, flag=wx.ALL, border=5)
+        sched.SetSizer(box_sched_sizer)
+
         # Buttons
         button_save = wx.Button(self, label="Save")
         button_cancel = wx.Button(self, label="Cancel")
@@ -100,6 +135,7 @@ class TitanEditModal(wx.Dialog):
         vbox.Add(panel, proportion=1, flag=wx.ALL | wx.EXPAND, border=5)
         vbox.Add(arguments, proportion=2, flag=wx.ALL | wx.EXPAND, border=5)
         vbox.Add(editor, proportion=3, flag=wx.ALL | wx.EXPAND, border=5)
+        vbox.Add(sched, flag=wx.ALL | wx.EXPAND, border=5)
         vbox.Add(hbox, flag=wx.ALIGN_CENTER | wx.TOP | wx.BOTTOM, border=10)
 
         self.SetSizer(vbox)
@@ -136,7 +172,27 @@ class TitanEditModal(wx.Dialog):
             exe_path = os.path.normpath(dialog.GetPath())
             self.textbox_location.SetValue(exe_path)
 
+    def _read_scheduling(self):
+        settings = {}
+        for prefix, (nice_ctrl, affinity_ctrl, ionice_ctrl) in self.sched_controls.items():
+            if nice_ctrl.GetValue().strip() != "":
+                settings[f"{prefix}nice"] = scheduling.parse_nice(nice_ctrl.GetValue().strip())
+
+            if affinity_ctrl.GetValue().strip() != "":
+                settings[f"{prefix}affinity"] = scheduling.parse_cpus(affinity_ctrl.GetValue())
+
+            if ionice_ctrl.GetStringSelection() != "":
+                settings[f"{prefix}ionice"] = ionice_ctrl.GetStringSelection()
+
+        return settings
+
     def OnSave(self, event):
+        try:
+            cur_scheduling = self._read_scheduling()
+        except ValueError as err:
+            utils.warning_dialog(f"Invalid scheduling settings!\n{err}")
+            return
+
         cur_title = self.textbox_title.GetValue()
         cur_location = self.textbox_location.GetValue()
         cur_preloads = self.proc_listbox.GetStrings()
@@ -158,6 +214,8 @@ class TitanEditModal(wx.Dialog):
         else:
             self.entry.preloads = []
 
+        self.entry.scheduling = cur_scheduling
+
         self.hasEdited = False
         self.OnClose(event)
 
@@ -20,24 +20,28 @@
     See NOTICE.txt for third-party license information.
 """
 
-import wx
 import time
-from titan.gui import titaneditmodal as tem
 
 
 class TitanEntry():
-    def __init__(self, title, location="", time_played=0, times_opened=0, pre=[], args=[]):
+    def __init__(self, title, location="", time_played=0, times_opened=0, pre=[], args=[], prewarm=None, scheduling=None):
+        self.id = None
         self.title = title
         self.location = location
         self.time_played = time_played
         self.times_opened = times_opened
         self.preloads = pre
         self.arguments = args
+        self.prewarm = [] if prewarm is None else prewarm     # globs read ahead on selection, see prewarm.py
+        self.scheduling = {} if scheduling is None else scheduling     # nice/affinity/ionice, see scheduling.py
 
     def get_time_played(self):
         return time.strftime("%H:%M:%S", time.gmtime(self.time_played))
 
     def edit(self):
+        # imported here so the CLI can use entries without loading wx
+        from titan.gui import titaneditmodal as tem
+
         modal = tem.TitanEditModal(self, None)
         modal.ShowModal()
         modal.Destroy()
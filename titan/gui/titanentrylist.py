@@ -21,52 +21,217 @@
 """
 
 import wx
+import asyncio
 import wx.lib.mixins.listctrl as listctrlmixins
 
+from titan import log
+from titan.gui import utils
+from titan.search import TrigramIndex, RESULT_LIMIT, normalize
+from titan.registry import EntryRegistry, DuplicateTitleError
+
 
 class TitanEntryList(wx.ListCtrl, listctrlmixins.ListCtrlAutoWidthMixin):
+    """
+    Virtual list backed by an EntryRegistry. wx asks for cell text through
+    OnGetItemText, the formatted cells are cached per entry and only rows
+    marked dirty are re-formatted and redrawn. Searching swaps the visible
+    rows for the ranked matches, the control itself is never rebuilt; the
+    search index is built off the UI thread after the first paint.
+    """
     def __init__(self, parent, *args, **kwargs):
-        wx.ListCtrl.__init__(self, parent, wx.ID_ANY, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        wx.ListCtrl.__init__(self, parent, wx.ID_ANY, style=wx.LC_REPORT | wx.LC_SINGLE_SEL | wx.LC_VIRTUAL)
         listctrlmixins.ListCtrlAutoWidthMixin.__init__(self)
         self.setResizeColumn(0)
         self.InsertColumn(0, "Title", width=110)
         self.InsertColumn(1, "Time Played", width=100)
         self.InsertColumn(2, "Times Opened", width=100)
-        self.entries = []
-
-    def get_entry(self, name):
-        for entry in self.entries:
-            if name == entry.title:
-                return entry
+        self.entries = EntryRegistry()
+        self.order = []         # every entry id, in library order
+        self.rows = []          # visible entry ids, in display order
+        self.query = ""
+        self.index = None       # TrigramIndex, see build_index
+        self.index_pending = None   # changes made while the index is being built
+        self.row_of = {}        # entry id -> row
+        self.cells = {}         # entry id -> formatted cell strings
+        self.dirty = set()      # entry ids that need to be re-formatted
+        self.broken = {}        # entry id -> problems found by the health scan
+        self.broken_attr = wx.ItemAttr()
+        self.broken_attr.SetTextColour(wx.RED)
+
+    def _format(self, entry):
+        return (str(entry.title), str(entry.get_time_played()), str(entry.times_opened))
+
+    def OnGetItemText(self, item, col):
+        entry_id = self.rows[item]
+        cells = self.cells.get(entry_id)
+        if cells is None:
+            cells = self._format(self.entries.get(entry_id))
+            self.cells[entry_id] = cells
+
+        return cells[col]
+
+    def OnGetItemAttr(self, item):
+        if self.rows[item] in self.broken:
+            return self.broken_attr
 
         return None
 
+    def get_entry(self, name):
+        return self.entries.get_by_title(name)
+
+    def get_row(self, entry):
+        return self.row_of.get(entry.id, -1)
+
+    def entry_at(self, row):
+        if row < 0 or row >= len(self.rows):
+            return None
+
+        return self.entries.get(self.rows[row])
+
+    def selected_entry(self):
+        return self.entry_at(self.GetFocusedItem())
+
+    def _show_rows(self, rows):
+        self.rows = rows
+        self.row_of = {entry_id: row for row, entry_id in enumerate(rows)}
+
+        # the focused row would point at another entry now
+        focused = self.GetFocusedItem()
+        if focused != -1:
+            self.SetItemState(focused, 0, wx.LIST_STATE_SELECTED | wx.LIST_STATE_FOCUSED)
+
+        self.SetItemCount(len(rows))
+        self.Refresh()
+
+    def set_filter(self, query):
+        self.query = query.strip()
+        if self.query == "":
+            self._show_rows(list(self.order))
+            return
+
+        if self.index is None:
+            # still being built, a plain substring scan until it's ready
+            query = normalize(self.query)
+            rows = [entry.id for entry in self.entries if query in normalize(entry.title)]
+            self._show_rows(rows[:RESULT_LIMIT])
+            return
+
+        self._show_rows(self.index.search(self.query))
+
+    def build_index(self):
+        # built in the executor from a snapshot of the library, changes made meanwhile are replayed on it
+        if self.index is not None or self.index_pending is not None:
+            return
+
+        self.index_pending = []
+        future = asyncio.get_event_loop().run_in_executor(None, TrigramIndex, list(self.entries))
+        future.add_done_callback(self._index_built)
+
+    def _index_built(self, future):
+        pending, self.index_pending = self.index_pending, None
+        if future.cancelled() or future.exception() is not None:
+            log.warning("Unable to build the search index", error=repr(future.exception()) if not future.cancelled() else "cancelled")
+            return
+
+        index = future.result()
+        for method, arg in pending:
+            getattr(index, method)(arg)
+        self.index = index
+
+        if self.query != "":
+            self.set_filter(self.query)
+
+    def _reindex(self, method, arg):
+        if self.index is not None:
+            getattr(self.index, method)(arg)
+        elif self.index_pending is not None:
+            self.index_pending.append((method, arg))
+
+    def add_entries(self, entries):
+        for entry in entries:
+            self.entries.add(entry)
+            self.order.append(entry.id)
+            self._reindex("add", entry)
+
+            if self.query == "":
+                self.row_of[entry.id] = len(self.rows)
+                self.rows.append(entry.id)
+
+        if self.query != "":
+            self.set_filter(self.query)
+        else:
+            self.SetItemCount(len(self.rows))
+
     def add_entry(self, entry):
-        self.entries.append(entry)
-        self.Append((entry.title, entry.get_time_played(), entry.times_opened))
+        self.add_entries((entry,))
+
+    def mark_dirty(self, entry):
+        self.dirty.add(entry.id)
+
+    def problems(self, entry):
+        return self.broken.get(entry.id, [])
+
+    def set_broken(self, results):
+        # results from HealthScanner.scan, only rows whose state changed are redrawn
+        for entry_id, problems in results.items():
+            if self.entries.get(entry_id) is None:
+                continue
+
+            if len(problems) > 0:
+                if self.broken.get(entry_id) != problems:
+                    self.broken[entry_id] = problems
+                    self.dirty.add(entry_id)
+            elif self.broken.pop(entry_id, None) is not None:
+                self.dirty.add(entry_id)
+
+        self.refresh_entries()
 
     def refresh_entries(self):
-        i = 0
-        for entry in self.entries:
-            self.SetItem(i, 0, str(entry.title))
-            self.SetItem(i, 1, str(entry.get_time_played()))
-            self.SetItem(i, 2, str(entry.times_opened))
-            i += 1
+        for entry_id in self.dirty:
+            self.cells.pop(entry_id, None)
+            row = self.row_of.get(entry_id)
+            if row is not None:
+                self.RefreshItem(row)
 
+        self.dirty.clear()
 
     def edit_entry(self, entry):
-        self.entries[entry].edit()
-        ent = self.entries[entry]
-        self.SetItem(entry, 0, str(ent.title))
-        self.SetItem(entry, 1, str(ent.get_time_played()))
-        self.SetItem(entry, 2, str(ent.times_opened))
+        entry.edit()
+        try:
+            self.entries.update(entry)
+        except DuplicateTitleError as err:
+            utils.warning_dialog(f"An entry named '{err.args[0]}' already exists! The title was not changed.")
+
+        self._reindex("update", entry)
+
+        self.mark_dirty(entry)
+        self.refresh_entries()
+
+    def _remove_row(self, row):
+        entry_id = self.rows.pop(row)
+        del self.row_of[entry_id]
+        self.order.remove(entry_id)
+        self._reindex("remove", entry_id)
+        self.cells.pop(entry_id, None)
+        self.dirty.discard(entry_id)
+        self.broken.pop(entry_id, None)
+
+        for i in range(row, len(self.rows)):
+            self.row_of[self.rows[i]] = i
+
+        self.SetItemCount(len(self.rows))
+        self.Refresh()
 
     def delete_entry(self, event):
         selection = self.GetFocusedItem()
         if selection != -1:
-            dialog = wx.MessageDialog(self, f"Are you sure you want to delete '{self.entries[selection].title}'? All stats will be removed.\nThis cannot be undone.", "Confirmation", style=wx.YES_NO)
+            entry = self.entry_at(selection)
+            dialog = wx.MessageDialog(self, f"Are you sure you want to delete '{entry.title}'? All stats will be removed.\nThis cannot be undone.", "Confirmation", style=wx.YES_NO)
             ok = dialog.ShowModal()
 
             if ok == wx.ID_YES:
-                del self.entries[selection]
-                self.DeleteItem(selection)
+                self.entries.remove(entry)
+                self._remove_row(selection)
+                return entry
+
+        return None
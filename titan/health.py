@@ -0,0 +1,132 @@
+"""
+    health.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import stat
+import time
+import threading
+
+from titan import log
+from titan import planner
+
+WORKERS = 16            # mostly waiting on the file system, network drives included
+RACY_SECONDS = 2        # folders changed this recently aren't cached, mtimes can be that coarse
+
+
+def entry_paths(entry):
+    # every executable Titan would start for entry itself, ENT[...] preloads are checked by name
+    paths = [entry.location]
+    paths.extend(preload for preload in entry.preloads if preload.strip() != "" and planner.entry_reference(preload) is None)
+    return paths
+
+
+def _is_file(path):
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+class HealthScanner():
+    """
+    Checks that every entry's location and preloads still exist, stat'ing
+    them in a thread pool. Results are cached per folder against its mtime,
+    which changes whenever a file in it is added, removed or renamed, so a
+    rescan only stats the files in folders that changed.
+    """
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._cache = {}        # folder -> (mtime_ns, {name: is a file})
+        self.statted = 0        # files stat'ed by the last scan
+
+    def _check_folder(self, folder, names):
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            with self._lock:
+                self._cache.pop(folder, None)
+            return {name: False for name in names}
+
+        with self._lock:
+            cached_mtime, found = self._cache.get(folder, (None, {}))
+        if cached_mtime != mtime:
+            found = {}
+
+        missing = [name for name in names if name not in found]
+        found = dict(found)
+        for name in missing:
+            found[name] = _is_file(os.path.join(folder, name))
+
+        with self._lock:
+            self.statted += len(missing)
+            if time.time() - mtime / 1e9 > RACY_SECONDS:
+                self._cache[folder] = (mtime, found)
+            else:
+                self._cache.pop(folder, None)
+
+        return {name: found[name] for name in names}
+
+    def scan(self, entries, get_entry):
+        """
+        Returns {entry id: [problems]} for entries, an empty list meaning the
+        entry is fine. Blocks, so the GUI runs it in an executor.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        start = time.perf_counter()
+        self.statted = 0
+
+        folders = {}
+        for entry in entries:
+            for path in entry_paths(entry):
+                if path != "":
+                    path = os.path.abspath(path)
+                    folders.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+
+        exists = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="health") as executor:
+            checks = {folder: executor.submit(self._check_folder, folder, names) for folder, names in folders.items()}
+            for folder, check in checks.items():
+                for name, found in check.result().items():
+                    exists[os.path.join(folder, name)] = found
+
+        results = {}
+        for entry in entries:
+            problems = []
+            if entry.location == "":
+                problems.append("No location set")
+
+            for path in entry_paths(entry):
+                if path != "" and not exists[os.path.abspath(path)]:
+                    problems.append(f"Missing {path}")
+
+            for preload in entry.preloads:
+                name = planner.entry_reference(preload)
+                if name is not None and get_entry(name) is None:
+                    problems.append(f"No entry named '{name}'")
+
+            results[entry.id] = problems
+
+        broken = sum(1 for problems in results.values() if len(problems) > 0)
+        log.info("Checked library", entries=len(results), folders=len(folders), statted=self.statted, broken=broken, seconds=round(time.perf_counter() - start, 3))
+        return results
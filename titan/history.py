@@ -0,0 +1,204 @@
+"""
+    history.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import sqlite3
+import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id      INTEGER PRIMARY KEY,
+    title   TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id          INTEGER PRIMARY KEY,
+    entry_id    INTEGER NOT NULL REFERENCES entries(id),
+    start       REAL NOT NULL,
+    end         REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_entry ON sessions(entry_id, start);
+CREATE INDEX IF NOT EXISTS sessions_by_start ON sessions(start);
+CREATE TABLE IF NOT EXISTS daily (
+    day         INTEGER NOT NULL,
+    entry_id    INTEGER NOT NULL,
+    seconds     REAL NOT NULL,
+    sessions    INTEGER NOT NULL,
+    PRIMARY KEY (day, entry_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS weekly (
+    week        INTEGER NOT NULL,
+    entry_id    INTEGER NOT NULL,
+    seconds     REAL NOT NULL,
+    sessions    INTEGER NOT NULL,
+    PRIMARY KEY (week, entry_id)
+) WITHOUT ROWID;
+"""
+
+UPSERT = """
+INSERT INTO {table} ({key}, entry_id, seconds, sessions) VALUES (?, ?, ?, ?)
+ON CONFLICT ({key}, entry_id) DO UPDATE SET
+    seconds = seconds + excluded.seconds,
+    sessions = sessions + excluded.sessions
+"""
+
+
+def day_number(date):
+    return date.toordinal()
+
+
+def week_number(date):
+    # ordinal of the monday starting the week
+    return date.toordinal() - date.weekday()
+
+
+def split_by_day(start, end):
+    # yields (local date, seconds) for every day the interval touches
+    current = datetime.datetime.fromtimestamp(start)
+    finish = datetime.datetime.fromtimestamp(end)
+
+    while current < finish:
+        midnight = datetime.datetime.combine(current.date() + datetime.timedelta(days=1), datetime.time())
+        upto = min(midnight, finish)
+        yield current.date(), (upto - current).total_seconds()
+        current = upto
+
+
+class SessionHistory():
+    """
+    Every finished session (start, end) in an SQLite database, plus per-day
+    and per-week totals that are updated in the same transaction as each
+    insert. Questions like "hours per game this month" or "top 5 this week"
+    only read the rollup tables, never the raw sessions.
+
+    Sessions that cross midnight are split across the days they touch.
+    Days and weeks are stored as date ordinals (local time).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self._entry_ids = {}
+
+    def close(self):
+        self.db.close()
+
+    def _entry_id(self, title, create=True):
+        entry_id = self._entry_ids.get(title)
+        if entry_id is not None:
+            return entry_id
+
+        row = self.db.execute("SELECT id FROM entries WHERE title = ?", (title,)).fetchone()
+        if row is not None:
+            entry_id = row[0]
+        elif create:
+            entry_id = self.db.execute("INSERT INTO entries (title) VALUES (?)", (title,)).lastrowid
+        else:
+            return None
+
+        self._entry_ids[title] = entry_id
+        return entry_id
+
+    def record(self, title, start, end):
+        with self.db:
+            entry_id = self._entry_id(title)
+            self.db.execute("INSERT INTO sessions (entry_id, start, end) VALUES (?, ?, ?)", (entry_id, start, end))
+
+            counted_week = set()
+            first = True
+            for date, seconds in split_by_day(start, end):
+                week = week_number(date)
+                self.db.execute(UPSERT.format(table="daily", key="day"), (day_number(date), entry_id, seconds, 1 if first else 0))
+                self.db.execute(UPSERT.format(table="weekly", key="week"), (week, entry_id, seconds, 0 if week in counted_week else 1))
+                counted_week.add(week)
+                first = False
+
+    def record_run(self, runner):
+        self.record(runner.initial_entry.title, runner.wall_start, runner.wall_start + runner.get_duration())
+
+    def rename(self, old_title, new_title):
+        with self.db:
+            entry_id = self._entry_id(old_title, create=False)
+            if entry_id is None:
+                return
+
+            if self._entry_id(new_title, create=False) is not None:
+                return  # both have history, keep them apart rather than guess
+
+            self.db.execute("UPDATE entries SET title = ? WHERE id = ?", (new_title, entry_id))
+            del self._entry_ids[old_title]
+            self._entry_ids[new_title] = entry_id
+
+    def totals(self, first_day, last_day, limit=None):
+        # [(title, seconds, sessions)] between two dates (inclusive), most played first
+        query = """
+            SELECT entries.title, SUM(daily.seconds), SUM(daily.sessions)
+            FROM daily JOIN entries ON entries.id = daily.entry_id
+            WHERE daily.day BETWEEN ? AND ?
+            GROUP BY daily.entry_id
+            ORDER BY SUM(daily.seconds) DESC
+        """
+        params = [day_number(first_day), day_number(last_day)]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return self.db.execute(query, params).fetchall()
+
+    def week_totals(self, date, limit=None):
+        query = """
+            SELECT entries.title, weekly.seconds, weekly.sessions
+            FROM weekly JOIN entries ON entries.id = weekly.entry_id
+            WHERE weekly.week = ?
+            ORDER BY weekly.seconds DESC
+        """
+        params = [week_number(date)]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return self.db.execute(query, params).fetchall()
+
+    def month_totals(self, year, month, limit=None):
+        first_day = datetime.date(year, month, 1)
+        next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+        return self.totals(first_day, next_month - datetime.timedelta(days=1), limit)
+
+    def top(self, n, days=None):
+        today = datetime.date.today()
+        first_day = datetime.date.min if days is None else today - datetime.timedelta(days=days - 1)
+        return self.totals(first_day, today, n)
+
+    def daily(self, title, first_day, last_day):
+        entry_id = self._entry_id(title, create=False)
+        if entry_id is None:
+            return []
+
+        rows = self.db.execute("SELECT day, seconds FROM daily WHERE entry_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+                               (entry_id, day_number(first_day), day_number(last_day))).fetchall()
+        return [(datetime.date.fromordinal(day), seconds) for day, seconds in rows]
+
+    def sessions(self, title, limit=20):
+        entry_id = self._entry_id(title, create=False)
+        if entry_id is None:
+            return []
+
+        return self.db.execute("SELECT start, end, end - start FROM sessions WHERE entry_id = ? ORDER BY start DESC LIMIT ?",
+                               (entry_id, limit)).fetchall()
@@ -0,0 +1,63 @@
+"""
+    host.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import sys
+import asyncio
+
+
+class Host():
+    """
+    Everything a Runner needs from the program that started it. This is the
+    console implementation used by the CLI, TitanFrame implements the same
+    methods on top of wx (status bar, entry list, wxasync).
+
+    start(coro_fn) calls coro_fn and returns the scheduled task, never None.
+    The session manager awaits its tick task, runners keep their launch and
+    exit watch tasks, so an implementation can't fire and forget.
+    """
+    def __init__(self, registry, journal, history=None):
+        self.entries = registry
+        self.journal = journal
+        self.history = history
+        self.sessions_ended = 0
+        self.sample_resources = False     # --sample-resources, see titan/sampler.py
+        self.track_process_tree = True
+
+    def status(self, msg):
+        if sys.stderr.isatty():
+            sys.stderr.write("\r\x1b[K")
+        print(msg, file=sys.stderr)
+
+    def tick(self, msg):
+        # the once-a-second clock, only worth showing on a terminal
+        if sys.stderr.isatty():
+            sys.stderr.write(f"\r\x1b[K{msg}")
+            sys.stderr.flush()
+
+    def start(self, coro_fn):
+        return asyncio.ensure_future(coro_fn())
+
+    def session_ended(self, runner):
+        self.journal.played(runner.initial_entry.title, runner.get_duration())
+        if self.history is not None:
+            self.history.record_run(runner)
+        self.sessions_ended += 1
@@ -0,0 +1,234 @@
+"""
+    journal.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import json
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+COMPACT_THRESHOLD = 64 * 1024   # bytes
+
+
+class FileLock():
+    """
+    Exclusive lock shared by every Titan process (the GUI, `titan run` from a
+    hotkey, ...). Reentrant within a process, so compaction can hold it
+    around the journal's own locked calls.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+        self._depth = 0
+        self._lock = threading.RLock()
+
+    def _acquire(self, fh):
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            return
+
+        # LK_LOCK gives up after ~10 seconds, keep trying until it's ours
+        fh.seek(0)
+        while True:
+            try:
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def _release(self, fh):
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                fh = open(self.path, "a+b")
+                self._acquire(fh)
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fh = fh
+
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                self._release(self._fh)
+            finally:
+                self._fh.close()
+                self._fh = None
+
+        self._lock.release()
+        return False
+
+
+class Journal():
+    """
+    Append-only log of changes made to the library since the config file
+    was last written. Every record carries an increasing sequence number and
+    the config file remembers the last sequence it contains (journal_seq),
+    so replaying never applies a record twice, even if Titan crashed between
+    rewriting the config and trimming the journal.
+
+    Several processes can write to the same journal, so appends, reads and
+    trims hold `lock` and sequence numbers come from the file's last record
+    rather than from memory. Trimming leaves a "mark" record behind to keep
+    that number from going backwards. `compact_lock` keeps two processes
+    from folding the journal into the config at the same time.
+
+    Records are one JSON object per line:
+        {"seq": 1, "op": "played", "title": ..., "time_played": 12.5, "times_opened": 1}
+        {"seq": 2, "op": "put", "title": ..., "entry": {...}, "old_title": ...}
+        {"seq": 3, "op": "delete", "title": ...}
+        {"seq": 3, "op": "mark", "title": null}
+    """
+    def __init__(self, path, threshold=COMPACT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.seq = 0
+        self.lock = FileLock(path + ".lock")
+        self.compact_lock = FileLock(path + ".compact.lock")
+
+    def _read(self):
+        records = []
+        valid = 0
+        if not os.path.exists(self.path):
+            return records, valid
+
+        with open(self.path, "rb") as fh:
+            for line in fh:
+                try:
+                    records.append(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    break   # torn write from a crash, nothing after it is valid
+                valid += len(line)
+
+        return records, valid
+
+    def load(self, base_seq):
+        with self.lock:
+            records, valid = self._read()
+            if valid < self.size():
+                with open(self.path, "r+b") as fh:
+                    fh.truncate(valid)
+
+        last_seq = records[-1]["seq"] if len(records) > 0 else 0
+        self.seq = max(last_seq, base_seq)
+        return [rec for rec in records if rec["seq"] > base_seq]
+
+    def append(self, op, title, **fields):
+        with self.lock:
+            # another process may have appended since, never reuse its numbers
+            records = self._read()[0]
+            last_seq = records[-1]["seq"] if len(records) > 0 else 0
+            seq = max(self.seq, last_seq) + 1
+            record = {"seq": seq, "op": op, "title": title, **fields}
+
+            # reopened every time, compaction elsewhere may have swapped the file
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(record) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+
+            self.seq = seq
+            return seq
+
+    def played(self, title, duration):
+        return self.append("played", title, time_played=duration, times_opened=1)
+
+    def put(self, table, old_title=None):
+        title, fields = next(iter(table.items()))
+        if old_title is not None and old_title != title:
+            return self.append("put", title, entry=fields, old_title=old_title)
+
+        return self.append("put", title, entry=fields)
+
+    def delete(self, entry):
+        return self.append("delete", entry.title)
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def needs_compaction(self):
+        return self.size() >= self.threshold
+
+    def has_changes(self):
+        # anything besides the mark a trim leaves behind
+        with self.lock:
+            return any(rec["op"] != "mark" for rec in self._read()[0])
+
+    def truncate(self, upto_seq):
+        # drop everything the config file now contains, keep anything newer
+        with self.lock:
+            keep = [rec for rec in self._read()[0] if rec["seq"] > upto_seq]
+            if len(keep) <= 0:
+                keep = [{"seq": upto_seq, "op": "mark", "title": None}]
+
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as fh:
+                for rec in keep:
+                    fh.write(json.dumps(rec) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(temp_path, self.path)
+
+
+def replay(games, records):
+    for rec in records:
+        title = rec["title"]
+        op = rec["op"]
+
+        if op == "played":
+            if title in games:
+                games[title]["time_played"] += rec["time_played"]
+                games[title]["times_opened"] += rec["times_opened"]
+        elif op == "put":
+            old_title = rec.get("old_title")
+            old = games.pop(old_title, None) if old_title is not None else None
+            if old is None:
+                old = games.get(title)
+
+            # stats only ever change through "played", the writer's copy may be stale
+            entry = dict(rec["entry"])
+            if old is not None:
+                entry["time_played"] = old["time_played"]
+                entry["times_opened"] = old["times_opened"]
+            games[title] = entry
+        elif op == "delete":
+            games.pop(title, None)
+
+    return games
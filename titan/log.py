@@ -0,0 +1,147 @@
+"""
+    log.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+from titan.globals import LOG_FILE, NAME_LOW
+
+QUEUE_SIZE = 1024           # records waiting for the writer, newer ones are dropped past this
+MAX_BYTES = 5 * 1000 * 1000
+BACKUP_COUNT = 3            # titan.log.1 ... titan.log.3
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+logger = logging.getLogger(NAME_LOW)
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+_handler = None
+_listener = None
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    One line per record: "[time] LEVEL message key=value ...". Values are JSON
+    encoded so strings with spaces stay on the line and can be parsed back.
+    """
+    def format(self, record):
+        line = f"[{self.formatTime(record)}] {record.levelname} {record.getMessage()}"
+
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={json.dumps(value, default=str)}" for key, value in fields.items())
+
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueWriter(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # only called on shutdown, waiting for room here is fine
+        self.queue.put(self._sentinel)
+
+
+def setup(path=LOG_FILE, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, queue_size=QUEUE_SIZE, level=INFO):
+    """
+    Starts the background writer. Logging calls only put the record on a bounded
+    queue, so they never wait on the disk; when the writer falls behind, records
+    are dropped and counted instead.
+    """
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    try:
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    except OSError as err:
+        print(f"Unable to write to log file '{path}'! Do you have the correct permissions? Reason: {err}")
+        return
+
+    file_handler.setFormatter(KeyValueFormatter())
+
+    records = queue.Queue(queue_size)
+    _handler = DroppingQueueHandler(records)
+    _listener = QueueWriter(records, file_handler)
+    _listener.start()
+
+    logger.addHandler(_handler)
+    logger.setLevel(level)
+    atexit.register(shutdown)
+
+
+def shutdown():
+    global _handler, _listener
+    if _listener is None:
+        return
+
+    logger.removeHandler(_handler)
+    _listener.stop()
+    if _handler.dropped > 0:
+        for handler in _listener.handlers:
+            handler.handle(logger.makeRecord(logger.name, WARNING, __file__, 0, "Log records were dropped", (), None, extra={"fields": {"count": _handler.dropped}}))
+
+    for handler in _listener.handlers:
+        handler.close()
+
+    _handler = None
+    _listener = None
+
+
+def event(level, msg, **fields):
+    logger.log(level, msg, extra={"fields": fields})
+
+
+def debug(msg, **fields):
+    event(DEBUG, msg, **fields)
+
+
+def info(msg, **fields):
+    event(INFO, msg, **fields)
+
+
+def warning(msg, **fields):
+    event(WARNING, msg, **fields)
+
+
+def error(msg, **fields):
+    event(ERROR, msg, **fields)
@@ -0,0 +1,244 @@
+"""
+    metrics.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import sys
+import time
+import threading
+
+from contextlib import ContextDecorator
+from titan.globals import METRICS_FILE, NAME_LOW
+
+FLAG = "--metrics"
+PORT_FLAG = "--metrics-port"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)     # seconds
+
+_lock = threading.Lock()
+_metrics = {}       # name -> Counter/Histogram, in registration order
+_export_path = None
+_server = None
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if len(pairs) <= 0:
+        return ""
+
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class Counter():
+    kind = "counter"
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.values = {}    # labels -> count
+
+    def inc(self, amount=1, **labels):
+        key = _labels(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with _lock:
+            values = dict(self.values)
+
+        return [f"{self.name}{_format_labels(labels)} {value}" for labels, value in values.items()]
+
+
+class Histogram():
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = buckets
+        self.values = {}    # labels -> [count per bucket..., total count, sum]
+
+    def observe(self, value, **labels):
+        key = _labels(labels)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def render(self):
+        with _lock:
+            values = {labels: list(series) for labels, series in self.values.items()}
+
+        lines = []
+        for labels, series in values.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-1]:.6f}")
+
+        return lines
+
+
+class Timer(ContextDecorator):
+    """
+    Observes how long a block (or, as a decorator, a call) took, including
+    when it raised.
+    """
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self._starts = threading.local()
+
+    def __enter__(self):
+        # a decorated function may run on several threads at once
+        stack = getattr(self._starts, "stack", None)
+        if stack is None:
+            stack = self._starts.stack = []
+        stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._starts.stack.pop(), **self.labels)
+        return False
+
+
+def _register(metric):
+    with _lock:
+        existing = _metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        _metrics[metric.name] = metric
+    return metric
+
+
+def counter(name, doc):
+    return _register(Counter(f"{NAME_LOW}_{name}", doc))
+
+
+def histogram(name, doc, buckets=BUCKETS):
+    return _register(Histogram(f"{NAME_LOW}_{name}", doc, buckets))
+
+
+def render():
+    lines = []
+    with _lock:
+        metrics = list(_metrics.values())
+
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.doc}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+def requested(argv=None):
+    # --metrics writes METRICS_FILE, --metrics=<file> writes somewhere else,
+    # --metrics-port=<port> serves them on http://127.0.0.1:<port>/metrics
+    argv = sys.argv[1:] if argv is None else argv
+    path = None
+    port = None
+    for arg in argv:
+        if arg == FLAG:
+            path = METRICS_FILE
+        elif arg.startswith(FLAG + "="):
+            path = arg[len(FLAG) + 1:]
+        elif arg.startswith(PORT_FLAG + "="):
+            port = int(arg[len(PORT_FLAG) + 1:])
+
+    return path, port
+
+
+def is_flag(arg):
+    return arg == FLAG or arg.startswith(FLAG + "=") or arg.startswith(PORT_FLAG + "=")
+
+
+def export(path=None, port=None):
+    global _export_path
+    _export_path = path
+    if port is not None:
+        serve(port)
+
+
+def flush():
+    # writes the export file, if one was requested
+    if _export_path is None:
+        return
+
+    temp_path = f"{_export_path}.tmp"
+    try:
+        with open(temp_path, "w") as fh:
+            fh.write(render())
+        os.replace(temp_path, _export_path)
+    except OSError as err:
+        print(f"Unable to write metrics to '{_export_path}'! Reason: {err}")
+
+
+def serve(port, host="127.0.0.1"):
+    global _server
+    if _server is not None:
+        return _server
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
+
+
+# the launch pipeline, see Runner and filehandler
+STAGE_SECONDS = histogram("stage_seconds", "Time spent in each stage of launching and ending a session.")
+CONFIG_SECONDS = histogram("config_seconds", "Time spent loading and saving the library.")
+LAUNCHES = counter("launches_total", "Entries started, by result.")
+SPAWNS = counter("spawns_total", "Processes created for entries and preloads, by kind and result.")
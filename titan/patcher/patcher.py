@@ -26,13 +26,153 @@ import sys
 import time
 import toml
 import psutil
+import zlib
+import json
 import shutil
 import asyncio
+import hashlib
+import zipfile
+import threading
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor
+
 from wxasync import AsyncBind, WxAsyncApp, StartCoroutine
 from asyncio.events import get_event_loop
 
+EXIT_TIMEOUT = 30       # seconds to wait for Titan to close
+EXIT_SLICE = 0.25       # keep the progress dialog alive while waiting
+MANIFEST_NAME = "manifest.json"
+PATCH_ROOT = "titan/"   # top level folder inside the release zip
+COPY_WORKERS = 8
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_crc32(path):
+    crc = 0
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def build_manifest(source_dir):
+    files = {}
+    for root, dirs, names in os.walk(source_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            if rel == MANIFEST_NAME:
+                continue
+
+            files[rel] = {"sha256": file_digest(path), "size": os.path.getsize(path)}
+
+    return {"files": files}
+
+
+def write_manifest(source_dir):
+    with open(os.path.join(source_dir, MANIFEST_NAME), "w") as fh:
+        json.dump(build_manifest(source_dir), fh, indent=1, sort_keys=True)
+
+
+def patch_members(archive):
+    members = {}
+    for info in archive.infolist():
+        if info.is_dir() or not info.filename.startswith(PATCH_ROOT):
+            continue
+
+        rel = info.filename[len(PATCH_ROOT):]
+        if rel.startswith("/") or ":" in rel or ".." in rel.split("/"):
+            raise OSError(f"Refusing to extract {info.filename} outside of Titan's folder")
+
+        members[rel] = info
+
+    return members
+
+
+def load_manifest(archive, members):
+    if MANIFEST_NAME in members:
+        return json.loads(archive.read(members[MANIFEST_NAME]).decode("utf-8"))
+
+    # patches built without a manifest are compared using the crc32 stored in the zip
+    files = {}
+    for rel, info in members.items():
+        files[rel] = {"crc32": info.CRC, "size": info.file_size}
+
+    return {"files": files}
+
+
+def is_unchanged(path, info):
+    try:
+        # only hash when the size matches, most changed files differ in size anyway
+        if os.path.getsize(path) != info["size"]:
+            return False
+
+        if "sha256" in info:
+            return file_digest(path) == info["sha256"]
+
+        return file_crc32(path) == info["crc32"]
+    except OSError:
+        return False
+
+
+def _restore(moved):
+    # puts back what swap_in moved, newest first, returns the files it couldn't
+    failed = []
+    for dst, backup in reversed(moved):
+        try:
+            if backup is not None:
+                os.replace(backup, dst)
+            elif os.path.exists(dst):
+                os.remove(dst)      # wasn't there before the update
+        except OSError:
+            failed.append(dst)
+
+    return failed
+
+
+def swap_in(staging_dir, backup_dir, working_dir, rels):
+    """
+    Moves the staged files over the install. Every file that gets replaced is
+    moved into backup_dir first and if any move fails all of them are put
+    back, so Titan is never left half old and half new.
+    """
+    if os.path.exists(backup_dir):
+        raise OSError(f"A previous update couldn't be undone, the original files are still in '{backup_dir}'")
+
+    moved = []      # (installed path, its backup or None if the file is new)
+    try:
+        for rel in rels:
+            dst = os.path.join(working_dir, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+            backup = None
+            if os.path.exists(dst):
+                backup = os.path.join(backup_dir, rel)
+                os.makedirs(os.path.dirname(backup), exist_ok=True)
+                os.replace(dst, backup)
+
+            moved.append((dst, backup))
+            os.replace(os.path.join(staging_dir, rel), dst)
+    except OSError as err:
+        failed = _restore(moved)
+        if len(failed) > 0:
+            raise OSError(f"{err}\nThe update couldn't be undone for {', '.join(failed)}, the original files are in '{backup_dir}'") from err
+
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        raise OSError(f"{err}\nThe update was undone, no files were changed") from err
+
+    # everything is in place, the originals aren't needed anymore
+    shutil.rmtree(backup_dir, ignore_errors=True)
+
 
 def is_process_running(name):
     for process in psutil.process_iter():
@@ -55,7 +195,14 @@ class TitanPatcherFrame(wx.Frame):
         self.progress = 0
         self.working_dir = "./"
         self.patch_parent_dir = os.path.join(self.working_dir, "patch")
-        self.patch_dir = os.path.join(self.patch_parent_dir, "titan")
+        self.staging_dir = os.path.join(self.patch_parent_dir, "staging")
+        self.backup_dir = os.path.join(self.patch_parent_dir, "backup")
+        self.progress_range = self.progress_bar.GetRange()
+        self.progress_lock = threading.Lock()
+        self.local = threading.local()
+        self.archives = []
+        self.copied_bytes = 0
+        self.total_bytes = 1
         self.patch_zip = os.path.join(self.working_dir, "patch.zip")
         self.config_file = os.path.join(self.working_dir, "titan_games.toml")
 
@@ -65,6 +212,7 @@ class TitanPatcherFrame(wx.Frame):
             return
 
         self.new_version = sys.argv[2]
+        self.titan_pid = int(sys.argv[3]) if len(sys.argv) >= 4 else None
 
         self.pre_check()
         self.start_patching()
@@ -77,7 +225,7 @@ class TitanPatcherFrame(wx.Frame):
 
             self.progress_bar.Update(self.progress, log_msg)
 
-            await asyncio.sleep(1)
+            await asyncio.sleep(0.25)
 
     async def _patch_config(self):
         if not os.path.exists(self.config_file):
@@ -98,40 +246,113 @@ class TitanPatcherFrame(wx.Frame):
     def pre_check(self):
         self.progress_bar.Pulse("Verifying files...")
 
-        if not os.path.exists(self.patch_parent_dir) or not os.path.exists(self.patch_zip):
+        if not os.path.exists(self.patch_zip):
             self._error_dialog(msg="Unable to find patch data. Please restart Titan or run it as Administrator and try again.")
             return
 
-        if is_process_running("titan.exe"):
+        if not self.wait_for_titan():
             self._error_dialog(msg="Titan is still running! Please close any other instances of Titan before trying to patch again.")
             return
 
+    def wait_for_titan(self):
+        # older versions of Titan don't pass their pid, fall back to looking for it by name
+        if self.titan_pid is None:
+            return not is_process_running("titan.exe")
+
+        try:
+            titan = psutil.Process(self.titan_pid)
+        except psutil.NoSuchProcess:
+            return True
+
+        deadline = time.monotonic() + EXIT_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                titan.wait(timeout=EXIT_SLICE)
+                return True
+            except psutil.TimeoutExpired:
+                self.progress_bar.Pulse("Waiting for Titan to close...")
+
+        return False
+
     async def _finalize_patch(self):
-        await asyncio.sleep(5)
+        self.progress_bar.Pulse("Updating configuration...")
+        await self._patch_config()
+
+        # everything is in place, restart right away
+        self.progress_bar.Pulse("Update finished! Restarting Titan...")
         titan_restart = subprocess.Popen([os.path.join(self.working_dir, "titan.exe"), "updated"], cwd=self.working_dir)
         sys.exit(0)
 
-    def start_patching(self):
-        self.progress_msg.append("Copying files...")
-        StartCoroutine(self._update_progress_bar, self)
-
-        for root, dirs, files in os.walk(self.patch_dir):
-            for file in files:
-                if ("_adv." in file) or ("_core." in file) or ("siplib." in file):
-                    wx_dir = os.path.join(self.patch_dir, "wx")
-                    shutil.copy(os.path.join(wx_dir, file), os.path.join(self.working_dir, "wx"))
-                else:
-                    self.progress += self.progress_bar.GetRange() / len(files)
-                    shutil.copy(os.path.join(self.patch_dir, file), self.working_dir)
+    def _add_progress(self, nbytes):
+        with self.progress_lock:
+            self.copied_bytes += nbytes
+            self.progress = int(self.progress_range * min(1.0, self.copied_bytes / self.total_bytes))
+
+    def _changed_files(self, manifest, pool):
+        def check(item):
+            rel, info = item
+            return item, is_unchanged(os.path.join(self.working_dir, rel), info)
+
+        return [item for item, unchanged in pool.map(check, manifest["files"].items()) if not unchanged]
+
+    def _archive(self):
+        # ZipFile handles can't be shared between threads, each worker opens its own
+        archive = getattr(self.local, "archive", None)
+        if archive is None:
+            archive = zipfile.ZipFile(self.patch_zip, "r")
+            self.local.archive = archive
+            with self.progress_lock:
+                self.archives.append(archive)
+
+        return archive
+
+    def _stage(self, rel):
+        dst = os.path.join(self.staging_dir, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+        # decompressed straight out of patch.zip, this is the only write of the file
+        with self._archive().open(PATCH_ROOT + rel, "r") as src_fh, open(dst, "wb") as dst_fh:
+            for chunk in iter(lambda: src_fh.read(CHUNK_SIZE), b""):
+                dst_fh.write(chunk)
+                self._add_progress(len(chunk))
+
+    def apply_patch(self):
+        # runs in the executor: compare against the manifest, extract what changed into a
+        # staging directory in parallel, then swap everything into place or nothing
+        with zipfile.ZipFile(self.patch_zip, "r") as archive:
+            members = patch_members(archive)
+            manifest = load_manifest(archive, members)
+
+        for rel in manifest["files"]:
+            if rel not in members:
+                raise OSError(f"Patch data is missing {rel}")
 
-            for _dir in dirs:
-                n_dir = os.path.join(self.working_dir, _dir)
-                if not os.path.exists(n_dir):
-                    os.mkdir(os.path.join(self.working_dir, _dir))
+        try:
+            with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+                self.progress_msg.append("Comparing files...")
+                changed = self._changed_files(manifest, pool)
+                self.total_bytes = max(1, sum(info["size"] for _, info in changed))
+
+                self.progress_msg.append(f"Extracting {len(changed)} of {len(manifest['files'])} files...")
+                list(pool.map(lambda item: self._stage(item[0]), changed))
+        finally:
+            for archive in self.archives:
+                archive.close()
+
+        self.progress_msg.append("Replacing files...")
+        swap_in(self.staging_dir, self.backup_dir, self.working_dir, [rel for rel, _ in changed])
+        return len(changed), len(manifest["files"])
+
+    async def _apply(self):
+        loop = asyncio.get_event_loop()
+        try:
+            changed, total = await loop.run_in_executor(None, self.apply_patch)
+        except (OSError, ValueError, zipfile.BadZipFile) as err:
+            self._error_dialog(msg=f"Titan ran into an unexpected error! Error:\n{err}")
+            return
 
         self.patch_is_finished = True
-        self.progress_bar.Pulse("Cleaning up files...")
-        time.sleep(1)
+        self.progress_bar.Pulse(f"Updated {changed} of {total} files. Cleaning up files...")
 
         try:
             if os.path.exists(self.patch_parent_dir):
@@ -142,14 +363,20 @@ class TitanPatcherFrame(wx.Frame):
         except OSError as err:
             self._error_dialog(msg=f"Titan ran into an unexpected error! Error:\n{err}")
 
-        self.progress_bar.Pulse("Updating configuration...")
-        StartCoroutine(self._patch_config, self)
-
-        self.progress_bar.Pulse("Update finished! Restarting Titan...")
         StartCoroutine(self._finalize_patch, self)
 
+    def start_patching(self):
+        self.progress_msg.append("Copying files...")
+        StartCoroutine(self._update_progress_bar, self)
+        StartCoroutine(self._apply, self)
+
 
 def main():
+    # build step: patcher.py make_manifest <dist dir>
+    if len(sys.argv) >= 3 and sys.argv[1] == "make_manifest":
+        write_manifest(sys.argv[2])
+        return
+
     app = WxAsyncApp()
     frame = TitanPatcherFrame(None, title=f"Titan Patcher")
     app.SetTopWindow(frame)
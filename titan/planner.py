@@ -0,0 +1,142 @@
+"""
+    planner.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import re
+
+from titan.registry import location_key
+
+ENTRY_REFERENCE = re.compile(r"^(ent|ENT).*\[(.*)\]")
+
+
+def entry_reference(preload):
+    # format: ent[game_name], ENT["Game Name"]
+    matches = ENTRY_REFERENCE.match(preload.strip())
+
+    if matches is None:
+        return None
+
+    # return name of entry
+    return matches.group(2).strip()
+
+
+class CycleError(Exception):
+    def __init__(self, chain):
+        super(CycleError, self).__init__(" -> ".join(chain))
+        self.chain = chain
+
+
+class LaunchNode():
+    def __init__(self, key, path, entry=None, owner=None):
+        self.key = key
+        self.path = path
+        self.entry = entry
+        self.owner = owner      # for preloads, the entry that listed it first
+        self.deps = []
+
+    def is_entry(self):
+        return self.entry is not None
+
+
+class LaunchPlan():
+    """
+    Expands an entry, its preloads and any chained ENT[...] entries into a
+    dependency graph before anything is started. Each node depends on the
+    preloads/entries that have to be started before it, so every node that
+    doesn't depend on another can be launched at the same time.
+
+    Nodes are keyed by their normalized location, so a program that appears
+    more than once in the chain is only started once. Cycles are found by
+    entry title, two entries that only share a location aren't a cycle, the
+    later one is skipped and reported in duplicates instead.
+    """
+    def __init__(self, entry, get_entry):
+        self.get_entry = get_entry
+        self.nodes = {}         # key -> node, dependencies always come first
+        self.missing = []       # ENT[...] names that don't exist
+        self.duplicates = []    # preloads and ENT[...] references that were already planned
+        self._planned = {}      # title -> node of every expanded entry
+        self._visiting = {}     # title -> key of entries being expanded
+        self.root = self._add_entry(entry)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+    def _add_entry(self, entry, preload=None):
+        if entry.title in self._visiting:
+            titles = list(self._visiting)
+            raise CycleError(titles[titles.index(entry.title):] + [entry.title])
+
+        # the same entry reached through another branch, a shared dependency
+        if entry.title in self._planned:
+            return self._planned[entry.title]
+
+        key = location_key(entry.location)
+
+        # a different entry with a program that's already in the chain
+        if key in self._visiting.values() or key in self.nodes:
+            self.duplicates.append(preload)
+            return self.nodes.get(key)
+
+        self._visiting[entry.title] = key
+        deps = []
+
+        for sub_preload in entry.preloads:
+            sub_entry = entry_reference(sub_preload)
+
+            if sub_entry is None:
+                dep = self._add_preload(sub_preload, entry)
+            else:
+                new_entry = self.get_entry(sub_entry)
+                if new_entry is None:
+                    self.missing.append(sub_entry)
+                    continue
+
+                dep = self._add_entry(new_entry, sub_preload)
+
+            if dep is not None and dep.key not in deps:
+                deps.append(dep.key)
+
+        del self._visiting[entry.title]
+
+        node = LaunchNode(key, entry.location, entry)
+        node.deps = deps
+        self.nodes[key] = node
+        self._planned[entry.title] = node
+        return node
+
+    def _add_preload(self, preload, owner):
+        key = location_key(preload)
+
+        if key in self._visiting.values():
+            self.duplicates.append(preload)
+            return None
+
+        if key in self.nodes:
+            self.duplicates.append(preload)
+            return self.nodes[key]
+
+        node = LaunchNode(key, preload.strip(), owner=owner)
+        self.nodes[key] = node
+        return node
@@ -0,0 +1,195 @@
+"""
+    prewarm.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import sys
+import glob
+import threading
+
+from titan import log
+from titan import planner
+
+WORKERS = 4
+IO_BUDGET = 256 * 1024 * 1024       # bytes per selection
+READ_CHUNK = 1024 * 1024
+LIBRARY_EXTENSIONS = (".dll", ".so", ".pyd", ".dylib")
+FLAG = "--prewarm"
+
+
+def requested(argv=None):
+    # off unless Titan was started with --prewarm, every selection may read up to IO_BUDGET
+    argv = sys.argv[1:] if argv is None else argv
+    return FLAG in argv
+
+
+def _libraries(directory):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    return [os.path.join(directory, name) for name in sorted(names) if name.lower().endswith(LIBRARY_EXTENSIONS) or ".so." in name]
+
+
+def targets(entry, get_entry):
+    """
+    Files worth having in the page cache before entry starts: every
+    executable in its launch plan, the libraries next to each one and the
+    entry's own prewarm globs (relative to its folder), in that order.
+    """
+    try:
+        locations = [node.path for node in planner.LaunchPlan(entry, get_entry)]
+    except planner.CycleError:
+        locations = [entry.location]
+
+    paths = []
+    for location in locations:
+        paths.append(location)
+        paths.extend(_libraries(os.path.dirname(location)))
+
+    base_dir = os.path.dirname(entry.location)
+    for pattern in entry.prewarm:
+        paths.extend(sorted(glob.glob(os.path.join(base_dir, pattern), recursive=True)))
+
+    seen = set()
+    unique = []
+    for path in paths:
+        key = os.path.normcase(os.path.abspath(path))
+        if key not in seen and os.path.isfile(path):
+            seen.add(key)
+            unique.append(path)
+
+    return unique
+
+
+class PrewarmJob():
+    def __init__(self, entry, get_entry, budget, workers):
+        self.entry = entry
+        self.get_entry = get_entry
+        self.budget = budget
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._paths = None
+        self._running = workers
+        self.warmed = 0     # bytes
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _next(self):
+        # hands out the next file and reserves its share of the budget
+        with self._lock:
+            if self._paths is None:
+                self._paths = iter(targets(self.entry, self.get_entry))
+
+            for path in self._paths:
+                if self.cancelled.is_set() or self.budget <= 0:
+                    return None, 0
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+
+                length = min(size, self.budget)
+                self.budget -= length
+                return path, length
+
+            return None, 0
+
+    def _warm(self, path, length):
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            if hasattr(os, "posix_fadvise"):
+                # the kernel reads it in the background, nothing is copied here
+                os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+                return length
+
+            # no readahead hint (Windows), read it ourselves in cancellable chunks
+            buf = bytearray(min(READ_CHUNK, length))
+            done = 0
+            with open(fd, "rb", buffering=0, closefd=False) as fh:
+                while done < length and not self.cancelled.is_set():
+                    read = fh.readinto(buf)
+                    if not read:
+                        break
+                    done += read
+            return done
+        finally:
+            os.close(fd)
+
+    def run(self):
+        try:
+            while not self.cancelled.is_set():
+                path, length = self._next()
+                if path is None:
+                    return
+
+                try:
+                    warmed = self._warm(path, length)
+                except OSError:
+                    continue
+
+                with self._lock:
+                    self.warmed += warmed
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+
+            if last:
+                log.debug("Prewarmed entry", entry=self.entry.title, bytes=self.warmed, cancelled=self.cancelled.is_set())
+
+
+class Prewarmer():
+    """
+    Reads an entry's files ahead in a small thread pool when it's selected, so
+    Start hits a warm page cache. Selecting something else cancels the
+    previous entry's job; every job stops after IO_BUDGET bytes.
+    """
+    def __init__(self, budget=IO_BUDGET, workers=WORKERS):
+        self.budget = budget
+        self.workers = workers
+        self.job = None
+        self._executor = None
+
+    def start(self, entry, get_entry):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.cancel()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prewarm")
+
+        self.job = PrewarmJob(entry, get_entry, self.budget, self.workers)
+        for _ in range(self.workers):
+            self._executor.submit(self.job.run)
+        return self.job
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+
+    def close(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,135 @@
+"""
+    proctree.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+
+try:
+    import psutil
+except ImportError:     # without psutil only the direct child is tracked
+    psutil = None
+
+CREATE_TIME_SLACK = 1.0     # seconds, create times are rounded to clock ticks
+
+
+def available():
+    return psutil is not None
+
+
+class ProcessTree():
+    """
+    Follows a root process and everything it spawns, so launchers that start
+    the real game and exit don't end the session.
+
+    Each scan() only lists pids (cheap: /proc on Linux, EnumProcesses on
+    Windows) and looks up the parent of pids that weren't there on the last
+    pass. Parent links are cached until the pid disappears, so a pass costs
+    O(new processes + tree size), not a full process_iter() over the system.
+    """
+    def __init__(self, root_pid, baseline=None, started=None, session=None, parents=None):
+        # baseline: pids that existed before the root was spawned, anything
+        # else is resolved on the first scan. That catches children even if
+        # the root already exited by then (on Windows the parent pid is kept).
+        # session: on POSIX the root runs in its own session, orphans get
+        # reparented to init but keep the session id, so they still match.
+        # parents: cache shared between trees scanned together (see SessionManager).
+        self.root = root_pid
+        self.session = session
+        self.parents = {} if parents is None else parents     # pid -> (ppid, create time) for every pid seen
+        self.members = {}       # pid -> create time, the tracked tree
+
+        if baseline is not None:
+            self.known = set(baseline)
+            self.members[root_pid] = started - CREATE_TIME_SLACK
+            return
+
+        self.known = set(psutil.pids())
+        try:
+            root = psutil.Process(root_pid)
+            self.members[root_pid] = root.create_time()
+            for child in root.children(recursive=True):
+                self.members[child.pid] = child.create_time()
+        except psutil.Error:
+            pass
+
+    def __len__(self):
+        return len(self.members)
+
+    def pids(self):
+        return list(self.members)
+
+    def descendants(self):
+        return len(self.members) - (1 if self.root in self.members else 0)
+
+    def _still_same(self, pid, created):
+        try:
+            proc = psutil.Process(pid)
+            with proc.oneshot():
+                # the root may only have an estimated create time (see __init__)
+                return proc.create_time() >= created and proc.status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            return False
+
+    def _in_session(self, pid):
+        try:
+            return os.getsid(pid) == self.session
+        except OSError:
+            return False
+
+    def scan(self, pids=None):
+        # works on a copy so pids() stays safe to call from another thread
+        pids = set(psutil.pids()) if pids is None else pids
+        members = dict(self.members)
+
+        for pid in self.known - pids:
+            self.parents.pop(pid, None)
+
+        new = []
+        for pid in pids - self.known:
+            if pid in self.parents:
+                new.append(pid)
+                continue
+
+            try:
+                proc = psutil.Process(pid)
+                self.parents[pid] = (proc.ppid(), proc.create_time())
+                new.append(pid)
+            except psutil.Error:
+                continue
+
+        # oldest first, so a child and grandchild that appeared in the same pass both join
+        new.sort(key=lambda pid: self.parents[pid][1])
+        for pid in new:
+            ppid, created = self.parents[pid]
+            parent_created = members.get(ppid)
+            if parent_created is not None and created >= parent_created:
+                members[pid] = created
+            elif self.session is not None and self._in_session(pid):
+                members[pid] = created
+
+        # a member may have exited, or died and had its pid reused, since the last pass
+        for pid, created in list(members.items()):
+            if pid not in pids or not self._still_same(pid, created):
+                del members[pid]
+
+        self.members = members
+        self.known = pids
+        return self.descendants()
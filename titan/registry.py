@@ -0,0 +1,137 @@
+"""
+    registry.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import itertools
+
+
+def location_key(path):
+    return os.path.normcase(os.path.normpath(path.strip()))
+
+
+class DuplicateTitleError(KeyError):
+    pass
+
+
+class EntryRegistry():
+    """
+    Holds every entry in the library, independent of any widget.
+
+    Entries get a stable id when they're added. Lookups by id, title and
+    normalized location are dict lookups, and adding, removing or renaming
+    an entry only touches that entry's index slots.
+    """
+    def __init__(self, entries=()):
+        self._next_id = itertools.count(1)
+        self._by_id = {}            # id -> entry, in insertion order
+        self._by_title = {}         # title -> id
+        self._by_location = {}      # location key -> {id: None}
+        self._indexed = {}          # id -> (title, location key) currently indexed
+
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __contains__(self, entry):
+        return getattr(entry, "id", None) in self._by_id
+
+    def _index(self, entry):
+        loc = location_key(entry.location)
+        self._by_title[entry.title] = entry.id
+        self._by_location.setdefault(loc, {})[entry.id] = None
+        self._indexed[entry.id] = (entry.title, loc)
+
+    def _unindex(self, entry_id):
+        title, loc = self._indexed.pop(entry_id)
+        del self._by_title[title]
+
+        ids = self._by_location[loc]
+        del ids[entry_id]
+        if len(ids) <= 0:
+            del self._by_location[loc]
+
+    def add(self, entry):
+        if entry.title in self._by_title:
+            raise DuplicateTitleError(entry.title)
+
+        entry.id = next(self._next_id)
+        self._by_id[entry.id] = entry
+        self._index(entry)
+        return entry.id
+
+    def remove(self, entry):
+        entry_id = getattr(entry, "id", entry)
+        removed = self._by_id.pop(entry_id)
+        self._unindex(entry_id)
+        return removed
+
+    def rename(self, entry, title):
+        entry.title = title
+        self.update(entry)
+
+    def update(self, entry):
+        # re-index an entry after its title/location were changed in place
+        old_title, old_loc = self._indexed[entry.id]
+        if entry.title == old_title and location_key(entry.location) == old_loc:
+            return
+
+        owner = self._by_title.get(entry.title)
+        duplicate = owner is not None and owner != entry.id
+        if duplicate:
+            entry.title = old_title
+
+        self._unindex(entry.id)
+        self._index(entry)
+
+        if duplicate:
+            raise DuplicateTitleError(self._by_id[owner].title)
+
+    def get(self, entry_id):
+        return self._by_id.get(entry_id)
+
+    def get_by_title(self, title):
+        entry_id = self._by_title.get(title)
+        if entry_id is None:
+            return None
+
+        return self._by_id[entry_id]
+
+    def get_by_location(self, path):
+        ids = self._by_location.get(location_key(path), {})
+        return [self._by_id[entry_id] for entry_id in ids]
+
+    def has_title(self, title):
+        return title in self._by_title
+
+    def unique_title(self, title):
+        if title not in self._by_title:
+            return title
+
+        for n in itertools.count(2):
+            candidate = f"{title} ({n})"
+            if candidate not in self._by_title:
+                return candidate
@@ -0,0 +1,57 @@
+"""
+    reporting.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import sys
+
+# Where warnings/errors raised by non-GUI code end up. The console handlers
+# are the default, the GUI swaps in wx dialogs with install().
+
+
+def _print_warning(msg):
+    print(f"Warning: {msg}", file=sys.stderr)
+
+
+def _print_error(msg):
+    print(f"Error: {msg}", file=sys.stderr)
+    sys.exit(-1)
+
+
+_handlers = {
+    "warning": _print_warning,
+    "error": _print_error,
+}
+
+
+def install(warning=None, error=None):
+    if warning is not None:
+        _handlers["warning"] = warning
+
+    if error is not None:
+        _handlers["error"] = error
+
+
+def warning(msg):
+    _handlers["warning"](msg)
+
+
+def error(msg):
+    _handlers["error"](msg)
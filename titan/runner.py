@@ -21,74 +21,140 @@
 """
 
 import os
-import re
-import wx
 import sys
 import time
 import asyncio
-import datetime
+import threading
 import subprocess
 
-from titan.gui import utils
-from titan.globals import CONFIG_FILE, LOG_FILE, NAME
+from titan import log
+from titan import metrics
+from titan import planner
+from titan import sampler
+from titan import proctree
+from titan import scheduling
+from titan import reporting
+from titan.globals import CONFIG_FILE, LOG_FILE, RESOURCES_FILE, NAME
 
-from wxasync import StartCoroutine
+POLL_INTERVAL = 0.5
+
+
+class ExitWatcher():
+    """
+    Waits for a child process to exit and reports the moment it did.
+
+    Backends, in order of preference:
+        pidfd  - Linux only, the pidfd becomes readable on exit (no extra thread)
+        thread - blocks on Popen.wait() in a thread of its own
+        poll   - the old Popen.poll() loop, only used if the others fail
+    """
+    def __init__(self, proc):
+        self.proc = proc
+        self.backend = None
+
+    async def wait(self):
+        for backend in (self._wait_pidfd, self._wait_thread):
+            try:
+                return await backend()
+            except (AttributeError, NotImplementedError, OSError, RuntimeError):
+                continue
+
+        return await self._wait_poll()
+
+    async def _wait_pidfd(self):
+        loop = asyncio.get_event_loop()
+        fd = os.pidfd_open(self.proc.pid)
+        exited = loop.create_future()
+
+        def on_exit():
+            if not exited.done():
+                exited.set_result(time.perf_counter())
+
+        try:
+            loop.add_reader(fd, on_exit)
+            self.backend = "pidfd"
+            try:
+                # the process may have exited before the reader was added
+                if self.proc.poll() is not None:
+                    on_exit()
+                return await exited
+            finally:
+                loop.remove_reader(fd)
+        finally:
+            os.close(fd)
+            self.proc.poll()    # reap the child
+
+    async def _wait_thread(self):
+        # not the default executor, a wait lasts as long as the game and would starve spawns and scans
+        loop = asyncio.get_event_loop()
+        exited = loop.create_future()
+
+        def on_exit(time_end):
+            if not exited.done():
+                exited.set_result(time_end)
+
+        def wait_blocking():
+            self.proc.wait()
+            try:
+                loop.call_soon_threadsafe(on_exit, time.perf_counter())
+            except RuntimeError:
+                pass    # the loop is already closed, Titan is exiting
+
+        threading.Thread(target=wait_blocking, name=f"exit-{self.proc.pid}", daemon=True).start()
+        self.backend = "thread"
+        return await exited
+
+    async def _wait_poll(self):
+        self.backend = "poll"
+        while self.proc.poll() is None:
+            await asyncio.sleep(POLL_INTERVAL)
+        return time.perf_counter()
 
 
 class Runner():
     """
+    Starts an entry and tracks it until it exits. The clock and process tree
+    are driven by a SessionManager, see titan/sessions.py; without one only
+    the entry's own process is tracked.
     """
-    def __init__(self, window, entry):
-        self.debug_log = []
-        self.already_wrote_log = False
-        self.window = window
+    def __init__(self, host, entry, manager=None):
+        self.host = host
         self.entry = entry
-        self.is_first = True
         self.initial_entry = entry
         self.initial_call = None
         self.initial_ret = None
-        self.queued_entries = []
-        self.run_log = []
+        self.launch = None
+        self.watch = None
+        self.sampler = None
+        self.tree = None
+        self.manager = manager
+        self.tree_seen = 0
+        self.tree_done = None
+        self.root_exited = None
+        self.plan = None
         self.running = False
         self.time_start = 0
         self.time_end = 0
-
-    def _write_debug(self):
-        with open(LOG_FILE, "a") as fh:
-            for msg in self.debug_log:
-                fh.write(msg)
-
-    def _log(self, msg, timestamp=True):
-        if timestamp:
-            current_time = datetime.datetime.now()
-            self.debug_log.append(f"[{current_time}] {msg}\n")
-        else:
-            self.debug_log.append(f"{msg}\n")
+        self.wall_start = 0
+        self.launch_start = 0
 
     def _start_timer(self):
         self.running = True
         self.time_start = time.perf_counter()
-        self._log("Timer has been started.")
+        self.wall_start = time.time()
+        log.debug("Timer started", entry=self.initial_entry.title)
 
-    def _end_timer(self):
-        self.time_end = time.perf_counter()
-        self._log("Timer has been stopped.")
+    def _end_timer(self, time_end=None):
+        self.time_end = time.perf_counter() if time_end is None else time_end
+        log.debug("Timer stopped", entry=self.initial_entry.title)
         self.running = False
 
-    def _preload_is_entry(self, preload):
-        # format: ent[game_name], ENT["Game Name"]
-        rexpr = re.compile(r"^(ent|ENT).*\[(.*)\]")
-        stripped = preload.strip()
-        matches = rexpr.match(stripped)
-
-        if matches is None:
-            return None
-
-        # return name of entry
-        return matches.group(2).strip()
+    def _wake_manager(self):
+        if self.manager is not None:
+            self.manager.wake()
 
     def _push_status(self, msg):
-        self.window.SetStatusText(msg)
+        self.host.status(msg)
 
     def get_duration(self):
         return self.time_end - self.time_start
@@ -96,113 +162,167 @@ class Runner():
     def get_duration_as_time(self):
         return time.strftime("%H:%M:%S", time.gmtime(self.get_duration()))
 
+    def get_elapsed_as_time(self):
+        return time.strftime("%H:%M:%S", time.gmtime(time.perf_counter() - self.time_start))
+
     def save_game_data(self):
-        self._log(f"Changed playtime of '{self.initial_entry.title}' from {self.initial_entry.time_played} to {self.initial_entry.time_played + self.get_duration()}")
+        log.info("Playtime changed", entry=self.initial_entry.title, old=self.initial_entry.time_played, new=self.initial_entry.time_played + self.get_duration())
         self.initial_entry.time_played += self.get_duration()
         self.initial_entry.times_opened += 1
 
-    def run_preload(self, preload):
-        self._log(f"Starting preload '{preload}'...")
-        if preload in self.run_log:
-            self._push_status(f"'{os.path.basename(preload)}' has already been called, {self.entry.title} tried to call it again. Skipping...")
-            return
-
-        self.run_log.append(preload)
+    # run_preload/run_entry are called from the executor, don't touch the UI in them
+    def run_preload(self, preload, settings=None):
+        settings = {} if settings is None else settings
+        proc = subprocess.Popen([preload], cwd=os.path.dirname(preload), creationflags=scheduling.creationflags(settings))
+        scheduling.apply(proc.pid, settings)
+        return proc
+
+    def run_entry(self, entry):
+        _cwd = os.path.dirname(entry.location)
+        settings = scheduling.entry_settings(entry)
+        # own session on POSIX, so the process tree can be followed after the entry's parent exits
+        proc = subprocess.Popen([entry.location, *entry.arguments], stdout=subprocess.PIPE, cwd=_cwd, universal_newlines=True, start_new_session=(os.name == "posix"), creationflags=scheduling.creationflags(settings))
+        scheduling.apply(proc.pid, settings)
+        return proc
+
+    async def _launch_node(self, node, started):
+        if len(node.deps) > 0:
+            await asyncio.gather(*(started[dep] for dep in node.deps))
+
+        loop = asyncio.get_event_loop()
+
+        if not node.is_entry():
+            log.info("Starting preload", path=node.path)
+            try:
+                with metrics.STAGE_SECONDS.time(stage="preload_spawn"):
+                    proc = await loop.run_in_executor(None, self.run_preload, node.path, scheduling.preload_settings(node.owner))
+                metrics.SPAWNS.inc(kind="preload", result="ok")
+                log.info("Preload started", path=node.path, pid=proc.pid)
+                return proc
+            except Exception as err:
+                # bad arguments or settings in a hand-edited config fail here too, not just missing files
+                metrics.SPAWNS.inc(kind="preload", result="error")
+                log.error("Unable to create process for preload", path=node.path, error=repr(err))
+                return None
+
+        log.info("Creating process", entry=node.entry.title, location=node.entry.location)
         try:
-            extproc = subprocess.Popen([preload], cwd=os.path.dirname(preload))
-            self._log(f"Preload has been started.")
-            return extproc
-        except OSError as err:
-            self._log(f"Fatal error while creating process for preload '{preload}'! Error:\n{err}")
-            self._write_debug()
-
-    def run_entry(self):
-        self._log(f"Creating process for entry '{self.entry.title}'...")
-        try:
-            _cwd = os.path.dirname(self.entry.location)
-            proc = subprocess.Popen([self.entry.location, *self.entry.arguments], stdout=subprocess.PIPE, cwd=_cwd, universal_newlines=True)
-            self._log(f"Process has been started.")
+            with metrics.STAGE_SECONDS.time(stage="entry_spawn"):
+                proc = await loop.run_in_executor(None, self.run_entry, node.entry)
+            metrics.SPAWNS.inc(kind="entry", result="ok")
+            log.info("Process started", entry=node.entry.title, pid=proc.pid)
             return proc
-        except OSError as err:
-            self._log(f"Fatal error while creating process for entry '{self.entry.title}'! Error:\n{err}")
-            self._write_debug()
-            utils.warning_dialog(f"Unable to start entry '{self.entry.title}', skipping! It may require {NAME} to be ran as Administrator.\nMore details in '{LOG_FILE}'.")
+        except Exception as err:
+            # a None root takes the failed launch path in _launch, so the session never hangs as running
+            metrics.SPAWNS.inc(kind="entry", result="error")
+            log.error("Unable to create process", entry=node.entry.title, location=node.entry.location, error=repr(err))
+            if isinstance(err, OSError):
+                reporting.warning(f"Unable to start entry '{node.entry.title}', skipping! It may require {NAME} to be ran as Administrator.\nMore details in '{LOG_FILE}'.")
+            else:
+                reporting.warning(f"Unable to start entry '{node.entry.title}', skipping! Check its arguments and settings.\nMore details in '{LOG_FILE}'.")
+            return None
 
-    async def _check_process(self):
-        while self.running:
-            if self.initial_call.poll() is not None:
-                break
-            cur_duration = time.strftime("%H:%M:%S", time.gmtime(time.perf_counter() - self.time_start))
-            self.window.SetStatusText(f"{self.initial_entry.title}: {cur_duration}")
-            await asyncio.sleep(0.5)
+    async def _launch(self):
+        track_tree = self.manager is not None and self.host.track_process_tree and proctree.available()
+        if track_tree:
+            baseline = proctree.psutil.pids()
+            spawned = time.time()
 
-        self.running = False
-        self._end_timer()
-        self.save_game_data()
-        self.window.entrylist.refresh_entries()
+        # nodes are ordered so dependencies are always scheduled first
+        started = {}
+        for node in self.plan:
+            started[node.key] = asyncio.ensure_future(self._launch_node(node, started))
+
+        self.initial_call = await started[self.plan.root.key]
 
-        if self.already_wrote_log is False:
-            self._write_debug()
+        if self.initial_call is None:
+            metrics.LAUNCHES.inc(result="failed")
+            self.running = False
+            self._wake_manager()
+            self._push_status(f"Unable to start entry '{self.initial_entry.title}'!")
+            return
 
-        self.window.SetStatusText(f"Entry '{self.initial_entry.title}' ran for {self.get_duration_as_time()}")
+        # from run() until the entry's own process exists, preloads included
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - self.launch_start, stage="launch")
+        metrics.LAUNCHES.inc(result="started")
+        self._start_timer()
+        self.root_exited = asyncio.Event()
 
-    def run(self):
-        self._log(f"Starting entry '{self.entry.title}'...")
+        if track_tree:
+            session = self.initial_call.pid if os.name == "posix" else None
+            self.tree = proctree.ProcessTree(self.initial_call.pid, baseline, spawned, session, self.manager.parents)
+            self.tree_done = asyncio.Event()
+
+        self.watch = self.host.start(self._check_process)
+
+        # sampled from the manager's tick, along with the tree scan
+        if self.manager is not None and self.host.sample_resources and sampler.available():
+            self.sampler = sampler.ResourceSampler(self.initial_call.pid, self.tree)
+
+        await asyncio.gather(*started.values())
+        log.info("All processes started", entry=self.initial_entry.title, count=len(self.plan))
 
-        if self.entry.location in self.run_log:
-            self.window.SetStatusText(f"Entry '{self.entry.title}' was already ran! Skipping...")
+    async def _check_process(self):
+        watcher = ExitWatcher(self.initial_call)
+        time_end = await watcher.wait()
+        log.info("Process exited", entry=self.initial_entry.title, backend=watcher.backend)
+
+        self.root_exited.set()
+        self._wake_manager()
+        # only the manager's tick sets tree_done, without one the tree can't be followed
+        if self.tree_done is not None and self.manager.ticking():
+            await self.tree_done.wait()
+            if self.tree_seen > time_end:
+                time_end = self.tree_seen
+                log.info("Process tree exited", entry=self.initial_entry.title)
+
+        self._end_timer(time_end)
+        with metrics.STAGE_SECONDS.time(stage="session_end"):
+            self.save_game_data()
+            self._save_resources()
+            self.host.session_ended(self)
+        self._wake_manager()
+        metrics.flush()
+
+        self._push_status(f"Entry '{self.initial_entry.title}' ran for {self.get_duration_as_time()}")
+
+    def _save_resources(self):
+        if self.sampler is None:
+            return
+
+        self.sampler.stop()
+        summary = self.sampler.summary()
+        if summary is None:
             return
 
-        self.run_log.append(self.entry.location)
-
-        if len(self.entry.preloads) > 0:
-            for preload in self.entry.preloads:
-                sub_entry = self._preload_is_entry(preload)
-
-                if sub_entry is None:   # load regular preload
-                    self.run_preload(preload)
-                else:                   # queue new entry
-                    new_entry = self.window.entrylist.get_entry(sub_entry)
-                    if new_entry is None:
-                        utils.warning_dialog(f"Entry '{sub_entry}' doesn't exist! Skipping...")
-                        continue
-
-                    if new_entry.location in self.run_log:
-                        utils.warning_dialog(f"Found recursive call of entry '{new_entry.title}' inside entry '{self.entry.title}'! More details in '{LOG_FILE}'")
-
-                        # recursive call logging
-                        self._log(f"Found recursive call of '{new_entry.title}' inside '{self.entry.title}'! Call order:")
-                        self._log("\n[RECURSIVE CALL ORDER (start)]", False)
-
-                        indent = 1
-                        for entry in self.run_log:
-                            self._log(f"\t{'-' * indent}> {entry}", False)
-                            indent += 1
-
-                        self._log("\t[WARNING OCCURRENCE]", False)
-                        self._log(f"\t{'-' * indent}> {new_entry.location} >>> called by entry '{self.entry.title}', exists in entry '{new_entry.title}'", False)
-                        self._log(f"\t{'-' * (indent + 1)}> {self.entry.location} >>> called by entry '{new_entry.title}', exists in entry '{self.entry.title}'", False)
-                        self._log("[RECURSIVE CALL ORDER (end)]", False)
-                        self._write_debug()
-                        self.already_wrote_log = True
-                        continue
-
-                    self.queued_entries.append(new_entry)
-                    self._log(f"Queued next entry '{new_entry.title}'")
-
-        proc = self.run_entry()
-
-        if self.is_first:
-            self._start_timer()
-            self.running = True
-            self.initial_call = proc
-            self.is_first = False
-            StartCoroutine(self._check_process, self.window)
-
-        if len(self.queued_entries) > 0:
-            self._log(f"Starting queued entries...")
-            for entry in self.queued_entries:
-                self.entry = entry
-                self.queued_entries.remove(entry)
-                self.run()
-            self._log("Queued entries have been started.")
+        sampler.save_summary(RESOURCES_FILE, self.initial_entry, self.wall_start, self.get_duration(), summary)
+        log.info("Resource usage", entry=self.initial_entry.title, peak_rss=summary["peak_rss"], avg_cpu=round(summary["avg_cpu"], 2), io_bytes=summary["io_bytes"])
+
+    def run(self):
+        log.info("Starting entry", entry=self.entry.title)
+        self.launch_start = time.perf_counter()
+
+        try:
+            with metrics.STAGE_SECONDS.time(stage="plan"):
+                self.plan = planner.LaunchPlan(self.entry, self.host.entries.get_by_title)
+        except planner.CycleError as err:
+            metrics.LAUNCHES.inc(result="cycle")
+            log.warning("Recursive entry call, nothing was started", entry=self.entry.title, chain=" > ".join(err.chain))
+            reporting.warning(f"Found recursive call of entry '{err.chain[-1]}' inside entry '{err.chain[-2]}'! Nothing was started. More details in '{LOG_FILE}'")
+            return False
+
+        for sub_entry in self.plan.missing:
+            log.warning("Entry doesn't exist, skipping", entry=self.entry.title, missing=sub_entry)
+            reporting.warning(f"Entry '{sub_entry}' doesn't exist! Skipping...")
+
+        for preload in self.plan.duplicates:
+            sub_entry = planner.entry_reference(preload)
+            if sub_entry is None:
+                log.info("Preload already started, skipping", entry=self.entry.title, preload=preload)
+            else:
+                log.warning("Entry shares its location with one already started, skipping", entry=self.entry.title, duplicate=sub_entry)
+                self._push_status(f"Entry '{sub_entry}' runs a program that was already started! Skipping...")
+
+        self.running = True
+        self.launch = self.host.start(self._launch)
+        return True
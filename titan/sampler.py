@@ -0,0 +1,223 @@
+"""
+    sampler.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import sys
+import json
+import time
+import datetime
+
+from array import array
+
+try:
+    import psutil
+except ImportError:     # sampling is optional, Titan works fine without it
+    psutil = None
+
+RING_CAPACITY = 4096        # samples kept per session
+MIN_INTERVAL = 1.0          # seconds
+MAX_INTERVAL = 60.0
+CPU_BUDGET = 0.002          # fraction of one core the sampler may use
+FIELDS = ("time", "cpu", "rss", "io")
+FLAG = "--sample-resources"
+
+
+def available():
+    return psutil is not None
+
+
+def requested(argv=None):
+    # off unless Titan was started with --sample-resources
+    argv = sys.argv[1:] if argv is None else argv
+    return FLAG in argv
+
+
+class RingBuffer():
+    """
+    Fixed-size buffer of float rows stored in a single array('d'), once it's
+    full the oldest row is overwritten. Memory use never grows past
+    capacity * len(fields) doubles, however long the session is.
+    """
+    def __init__(self, capacity=RING_CAPACITY, fields=FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.width = len(fields)
+        self.data = array("d", bytes(8 * capacity * self.width))
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, row):
+        start = self.head * self.width
+        self.data[start:start + self.width] = array("d", row)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def rows(self):
+        first = (self.head - self.count) % self.capacity
+        for i in range(self.count):
+            start = ((first + i) % self.capacity) * self.width
+            yield tuple(self.data[start:start + self.width])
+
+
+class ResourceSampler():
+    """
+    Samples CPU time, RSS and I/O bytes of a process and all of its
+    descendants. CPU and I/O are cumulative, the last values seen for
+    children that already exited are kept so they still count. CPU also
+    includes the children each process waited for, so children that exit
+    between two samples aren't lost. Each sample is timed and the interval
+    grows so the sampler stays under CPU_BUDGET of one core.
+    """
+    def __init__(self, pid, tree=None, capacity=RING_CAPACITY, budget=CPU_BUDGET):
+        self.pid = pid
+        self.tree = tree
+        self.samples = RingBuffer(capacity)
+        self.budget = budget
+        self.interval = MIN_INTERVAL
+        self.next_sample = 0.0      # perf_counter time the next sample is due
+        self.running = True
+        self.peak_rss = 0
+        self.first = None
+        self.last = None
+        self.sample_time = 0.0
+        self._root = None
+        self._procs = {}
+        self._totals = {}       # (pid, create time) -> (cpu seconds, io bytes) last seen
+        self._reaped = {}       # (pid, create time) -> cpu seconds of children it waited for
+        self._parents = {}      # (pid, create time) -> ppid
+        self._live = {}         # pid -> (pid, create time) in the last sample
+
+    def _tree(self):
+        if self.tree is not None:
+            # the ProcessTree already knows the members, no need to walk every process
+            procs = {}
+            for pid in self.tree.pids():
+                try:
+                    procs[pid] = self._procs.get(pid) or psutil.Process(pid)
+                except psutil.Error:
+                    continue
+
+            self._procs = procs
+            return list(procs.values())
+
+        try:
+            if self._root is None:
+                self._root = psutil.Process(self.pid)
+            return [self._root] + self._root.children(recursive=True)
+        except psutil.Error:
+            return []
+
+    def sample(self):
+        started = time.perf_counter()
+        rss = 0
+        live = {}
+        grew = set()
+
+        for proc in self._tree():
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    ppid = proc.ppid()
+                    rss += proc.memory_info().rss
+                    io = 0
+                    if hasattr(proc, "io_counters"):
+                        counters = proc.io_counters()
+                        io = counters.read_bytes + counters.write_bytes
+            except psutil.Error:
+                continue
+
+            # keyed with the create time so a reused pid is never mixed up
+            key = (proc.pid, proc.create_time())
+            # always 0 on Windows and macOS
+            reaped = getattr(cpu, "children_user", 0) + getattr(cpu, "children_system", 0)
+            if reaped > self._reaped.get(key, 0):
+                grew.add(key)
+
+            self._totals[key] = (cpu.user + cpu.system + reaped, io)
+            self._reaped[key] = reaped
+            self._parents[key] = ppid
+            live[proc.pid] = key
+
+        for pid, key in self._live.items():
+            if live.get(pid) == key:
+                continue
+
+            # waited for by a parent that's still here, its children times include it now
+            if live.get(self._parents.pop(key)) in grew:
+                del self._totals[key]
+            del self._reaped[key]
+
+        self._live = live
+        cpu_total = sum(cpu for cpu, _ in self._totals.values())
+        io_total = sum(io for _, io in self._totals.values())
+        row = (time.time(), cpu_total, float(rss), float(io_total))
+
+        self.samples.append(row)
+        self.peak_rss = max(self.peak_rss, rss)
+        if self.first is None:
+            self.first = row
+        self.last = row
+
+        cost = time.perf_counter() - started
+        self.sample_time += cost
+        self.interval = min(MAX_INTERVAL, max(MIN_INTERVAL, cost / self.budget))
+        self.next_sample = started + cost + self.interval
+        return row
+
+    def is_due(self, now):
+        # the SessionManager calls sample() from its tick once this is true
+        return self.running and now >= self.next_sample
+
+    def stop(self):
+        self.running = False
+
+    def summary(self):
+        if self.first is None:
+            return None
+
+        duration = self.last[0] - self.first[0]
+        cpu = self.last[1] - self.first[1]
+        return {
+            "samples": self.samples.count,
+            "peak_rss": self.peak_rss,
+            "avg_cpu": cpu / duration if duration > 0 else 0.0,     # cores
+            "cpu_time": self.last[1],
+            "io_bytes": int(self.last[3]),
+            "sampler_time": self.sample_time,
+        }
+
+
+def save_summary(path, entry, time_start, duration, summary):
+    record = {
+        "title": entry.title,
+        "start": datetime.datetime.fromtimestamp(time_start).isoformat(),
+        "duration": duration,
+        **summary,
+    }
+
+    try:
+        with open(path, "a") as fh:
+            fh.write(json.dumps(record) + "\n")
+    except OSError as err:
+        print(f"Unable to write resource summary to '{path}'! Reason: {err}")
@@ -0,0 +1,149 @@
+"""
+    scheduling.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+
+from titan import log
+
+FIELDS = ("nice", "affinity", "ionice")
+PRELOAD_FIELDS = tuple(f"preload_{field}" for field in FIELDS)
+ALL_FIELDS = FIELDS + PRELOAD_FIELDS
+NICE_RANGE = (-20, 19)
+IONICE_CLASSES = ("idle", "low", "normal", "high")
+
+# Optional per-entry TOML fields, applied when a process is spawned:
+#   nice             -20 (highest) to 19 (lowest), mapped to a priority class on Windows
+#   affinity         list of CPU numbers, or a bit mask (0b0011 = CPUs 0 and 1)
+#   ionice           one of IONICE_CLASSES
+#   preload_*        the same, for the entry's preloads (ENT[...] entries use their own)
+
+
+def entry_settings(entry):
+    return {field: entry.scheduling[field] for field in FIELDS if field in entry.scheduling}
+
+
+def preload_settings(entry):
+    if entry is None:
+        return {}
+
+    return {field: entry.scheduling[f"preload_{field}"] for field in FIELDS if f"preload_{field}" in entry.scheduling}
+
+
+def cpus(affinity):
+    if isinstance(affinity, int):
+        return [cpu for cpu in range(affinity.bit_length()) if affinity & (1 << cpu)]
+
+    return [int(cpu) for cpu in affinity]
+
+
+def parse_cpus(text):
+    # "0,2-3" -> [0, 2, 3]
+    result = []
+    for part in text.replace(" ", "").split(","):
+        if part == "":
+            continue
+
+        if "-" in part:
+            first, last = part.split("-", 1)
+            result.extend(range(int(first), int(last) + 1))
+        else:
+            result.append(int(part))
+
+    if any(cpu < 0 for cpu in result):
+        raise ValueError(f"Invalid CPU list '{text}'")
+
+    return sorted(set(result))
+
+
+def format_cpus(affinity):
+    return ",".join(str(cpu) for cpu in cpus(affinity))
+
+
+def parse_nice(text):
+    nice = int(text)
+    if not NICE_RANGE[0] <= nice <= NICE_RANGE[1]:
+        raise ValueError(f"Priority must be between {NICE_RANGE[0]} and {NICE_RANGE[1]}")
+
+    return nice
+
+
+def _windows_priority(nice):
+    import subprocess
+
+    if nice >= 15:
+        return subprocess.IDLE_PRIORITY_CLASS
+    if nice >= 5:
+        return subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    if nice > -5:
+        return subprocess.NORMAL_PRIORITY_CLASS
+    if nice > -15:
+        return subprocess.ABOVE_NORMAL_PRIORITY_CLASS
+    return subprocess.HIGH_PRIORITY_CLASS
+
+
+def creationflags(settings):
+    # Windows takes the priority class when the process is created, POSIX gets nice right after
+    if os.name != "nt" or "nice" not in settings:
+        return 0
+
+    return _windows_priority(int(settings["nice"]))
+
+
+def _set_ionice(psutil, proc, level):
+    index = IONICE_CLASSES.index(level)
+    if hasattr(psutil, "IOPRIO_CLASS_IDLE"):
+        # Linux, realtime needs root so "high" is the top of best-effort
+        if level == "idle":
+            proc.ionice(psutil.IOPRIO_CLASS_IDLE)
+        else:
+            proc.ionice(psutil.IOPRIO_CLASS_BE, (7, 4, 0)[index - 1])
+        return
+
+    proc.ionice((psutil.IOPRIO_VERYLOW, psutil.IOPRIO_LOW, psutil.IOPRIO_NORMAL, psutil.IOPRIO_HIGH)[index])
+
+
+def apply(pid, settings):
+    """
+    Applies settings to a freshly spawned process. Anything the platform or
+    our privileges don't allow (raising priority usually needs admin) is
+    logged and skipped, the process keeps running either way.
+    """
+    if len(settings) <= 0:
+        return
+
+    try:
+        import psutil
+        proc = psutil.Process(pid)
+    except (ImportError, OSError) as err:
+        log.warning("Unable to apply scheduling settings", pid=pid, error=str(err))
+        return
+
+    for field, value in settings.items():
+        try:
+            if field == "nice" and os.name != "nt":
+                proc.nice(int(value))
+            elif field == "affinity":
+                proc.cpu_affinity(cpus(value))
+            elif field == "ionice":
+                _set_ionice(psutil, proc, value)
+        except (psutil.Error, ValueError, TypeError, AttributeError, OSError) as err:
+            log.warning("Unable to apply scheduling setting", pid=pid, field=field, value=value, error=str(err))
@@ -0,0 +1,218 @@
+"""
+    search.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import os
+import heapq
+import itertools
+
+from collections import Counter
+
+RESULT_LIMIT = 500          # ranked results returned, the list shows these
+RANK_LIMIT = 300            # candidates per tier ranked in Python, the rest of a huge match set is dropped
+COMMON_RANK_LIMIT = 100     # the same when titles starting with the query alone fill the results
+COMMON_SLICE = 2            # times the limit, title prefix matches checked for that
+FUZZY_BELOW = 20            # look for near misses when fewer exact matches than this
+FUZZY_RATIO = 0.6           # fraction of the query's trigrams a near miss must share
+PREFIX_LENGTH = 3           # title prefixes indexed, 1 to PREFIX_LENGTH characters
+EMPTY = frozenset()
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def trigrams(text):
+    # padded so the start and end of words count too
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _prefixes(title):
+    return {title[:length] for length in range(1, PREFIX_LENGTH + 1) if len(title) >= length}
+
+
+def _add_posting(postings, key, entry_id):
+    ids = postings.get(key)
+    if ids is None:
+        ids = postings[key] = set()
+    ids.add(entry_id)
+
+
+def _remove_posting(postings, key, entry_id):
+    ids = postings[key]
+    ids.discard(entry_id)
+    if len(ids) <= 0:
+        del postings[key]
+
+
+class TrigramIndex():
+    """
+    Type-ahead search over entry titles and location file names. Every
+    trigram maps to the set of entry ids containing it, so a query only
+    touches the postings of its own trigrams: exact matches are the
+    intersection of those sets (done in C, smallest first), near misses are
+    entries sharing most of them. Title prefixes get postings of their own,
+    so the best matches (titles starting with the query) are split off with
+    set operations too and only a bounded number of candidates is ranked in
+    Python. Entries are added, updated and removed one at a time.
+    """
+    def __init__(self, entries=()):
+        self.postings = {}      # trigram -> set of entry ids
+        self.starts = {}        # title prefix -> set of entry ids
+        self.docs = {}          # entry id -> (title, location name, trigrams)
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _document(self, entry):
+        title = normalize(entry.title)
+        location = normalize(os.path.basename(entry.location or ""))
+        return title, location, frozenset(trigrams(title) | trigrams(location))
+
+    def _index(self, entry_id, doc):
+        for gram in doc[2]:
+            _add_posting(self.postings, gram, entry_id)
+        for prefix in _prefixes(doc[0]):
+            _add_posting(self.starts, prefix, entry_id)
+
+    def _unindex(self, entry_id, doc):
+        for gram in doc[2]:
+            _remove_posting(self.postings, gram, entry_id)
+        for prefix in _prefixes(doc[0]):
+            _remove_posting(self.starts, prefix, entry_id)
+
+    def add(self, entry):
+        doc = self._document(entry)
+        self.docs[entry.id] = doc
+        self._index(entry.id, doc)
+
+    def remove(self, entry_id):
+        doc = self.docs.pop(entry_id, None)
+        if doc is not None:
+            self._unindex(entry_id, doc)
+
+    def update(self, entry):
+        # only the trigrams and prefixes that changed are touched
+        old = self.docs.get(entry.id)
+        if old is None:
+            self.add(entry)
+            return
+
+        new = self._document(entry)
+        self.docs[entry.id] = new
+        for gram in old[2] - new[2]:
+            _remove_posting(self.postings, gram, entry.id)
+        for gram in new[2] - old[2]:
+            _add_posting(self.postings, gram, entry.id)
+
+        old_prefixes = _prefixes(old[0])
+        new_prefixes = _prefixes(new[0])
+        for prefix in old_prefixes - new_prefixes:
+            _remove_posting(self.starts, prefix, entry.id)
+        for prefix in new_prefixes - old_prefixes:
+            _add_posting(self.starts, prefix, entry.id)
+
+    def _rank(self, query, entry_id, shared=0):
+        title, location, _ = self.docs[entry_id]
+        if title.startswith(query):
+            kind = 0
+        elif query in title:
+            kind = 1
+        elif query in location:
+            kind = 2
+        else:
+            kind = 3
+
+        return (kind, -shared, len(title), title)
+
+    def _best(self, query, found, shared=0, limit=RESULT_LIMIT, rank_limit=RANK_LIMIT):
+        # titles starting with the query first, only rank_limit of each tier reach _rank
+        head = found & self.starts.get(query[:PREFIX_LENGTH], EMPTY)
+        candidates = list(itertools.islice(head, rank_limit))
+        if len(head) < limit:
+            candidates.extend(itertools.islice(found - head, rank_limit))
+
+        ranked = heapq.nsmallest(limit, candidates, key=lambda entry_id: self._rank(query, entry_id, shared))
+        if len(ranked) >= limit or len(ranked) >= len(found):
+            return ranked
+
+        # the matches that didn't make the sample still show up, unranked, after the best ones
+        chosen = set(candidates)
+        rest = (entry_id for entry_id in found if entry_id not in chosen)
+        return ranked + list(itertools.islice(rest, limit - len(ranked)))
+
+    def search(self, text, limit=RESULT_LIMIT):
+        """
+        Returns entry ids, best match first. Queries shorter than a trigram
+        only match the start of words, a single character only the start of
+        titles. Very common queries rank a bounded sample of their matches,
+        typing more narrows them down.
+        """
+        query = normalize(text)
+        if len(query) <= 0:
+            return []
+
+        if len(query) == 1:
+            return self._best(query, self.starts.get(query, EMPTY), limit=limit)
+
+        if len(query) == 2:
+            # too short for a trigram, " ti" matches every word starting with it
+            return self._best(query, self.postings.get(f" {query}", EMPTY), limit=limit)
+
+        # no padding at the end, the last word is usually still being typed
+        padded = f" {query}"
+        grams = {padded[i:i + 3] for i in range(len(padded) - 2)}
+        postings = sorted((self.postings.get(gram, EMPTY) for gram in grams), key=len)
+
+        # a common word fills the results with titles starting with it alone, so a
+        # slice of those is checked before intersecting every title containing it
+        prefix = self.starts.get(query[:PREFIX_LENGTH], EMPTY)
+        if len(prefix) >= limit:
+            head = set(itertools.islice(prefix, COMMON_SLICE * limit)).intersection(*postings)
+            if len(head) >= limit:
+                return self._best(query, head, len(grams), limit, COMMON_RANK_LIMIT)
+
+        exact = postings[0].intersection(*postings[1:])
+
+        # every trigram matching doesn't guarantee the text does, rank sorts that out
+        ranked = self._best(query, exact, len(grams), limit)
+        if len(ranked) >= FUZZY_BELOW:
+            return ranked
+
+        # a near miss shares `needed` trigrams, so it's in at least one of the
+        # len(grams) - needed + 1 smallest postings; only those are counted
+        needed = max(1, int(len(grams) * FUZZY_RATIO + 0.5))
+        pool = set()
+        for ids in postings[:len(postings) - needed + 1]:
+            pool |= ids
+        pool -= exact
+        pool = set(itertools.islice(pool, RANK_LIMIT))
+
+        shared = Counter()
+        for ids in postings:
+            shared.update(ids & pool)
+
+        near = [entry_id for entry_id, count in shared.items() if count >= needed]
+        near.sort(key=lambda entry_id: self._rank(query, entry_id, shared[entry_id]))
+        return (ranked + near)[:limit]
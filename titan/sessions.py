@@ -0,0 +1,160 @@
+"""
+    sessions.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import time
+import asyncio
+
+from titan import proctree
+from titan.runner import Runner
+
+TICK_INTERVAL = 1.0
+TICK_TITLES = 3         # sessions named in the status line, the rest are counted
+
+
+class SessionManager():
+    """
+    Owns every active Runner and drives all of them from one task: each tick
+    updates the clock once, scans the process trees of every session and
+    takes the resource samples that are due in a single executor call
+    (sharing one pid listing and one parent cache) and drops sessions that
+    have ended. Exits are still picked up by each Runner's ExitWatcher,
+    which doesn't wake up until the process is gone and then wakes the tick
+    early. The task only runs while there are sessions.
+    """
+    def __init__(self, host, interval=TICK_INTERVAL, on_change=None):
+        self.host = host
+        self.interval = interval
+        self.on_change = on_change
+        self.sessions = []
+        self.parents = {}       # pid -> (ppid, create time), shared by every ProcessTree
+        self._ticker = None
+        self._wake = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(list(self.sessions))
+
+    def is_running(self, entry):
+        return any(runner.initial_entry is entry for runner in self.sessions)
+
+    def start(self, entry):
+        runner = Runner(self.host, entry, self)
+        if not runner.run():
+            return None
+
+        self.sessions.append(runner)
+        if not self.ticking():
+            self._wake = asyncio.Event()
+            self._ticker = self.host.start(self._tick)
+
+        self._changed()
+        return runner
+
+    async def wait(self):
+        # returns once every session has ended
+        if self._ticker is not None:
+            await self._ticker
+
+    def ticking(self):
+        return self._ticker is not None and not self._ticker.done()
+
+    def wake(self):
+        # a root process exited or a session ended, don't wait for the next tick
+        if self._wake is not None:
+            self._wake.set()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _show_clock(self, started):
+        if len(started) <= 0:
+            return
+
+        clocks = [f"{runner.initial_entry.title}: {runner.get_elapsed_as_time()}" for runner in started[:TICK_TITLES]]
+        if len(started) > TICK_TITLES:
+            clocks.append(f"+{len(started) - TICK_TITLES} more")
+
+        self.host.tick(" | ".join(clocks))
+
+    def _poll(self, runners, samplers):
+        # trees first, so the samplers see this tick's members
+        counts = []
+        if len(runners) > 0:
+            pids = set(proctree.psutil.pids())
+            counts = [runner.tree.scan(pids) for runner in runners]
+
+        for resource_sampler in samplers:
+            resource_sampler.sample()
+
+        return counts
+
+    async def _poll_processes(self, started):
+        runners = [runner for runner in started if runner.tree is not None and not runner.tree_done.is_set()]
+        now = time.perf_counter()
+        samplers = [runner.sampler for runner in started if runner.sampler is not None and runner.sampler.is_due(now)]
+        if len(runners) <= 0 and len(samplers) <= 0:
+            return
+
+        loop = asyncio.get_event_loop()
+        counts = await loop.run_in_executor(None, self._poll, runners, samplers)
+        now = time.perf_counter()
+        for runner, descendants in zip(runners, counts):
+            # keeps the session open while anything the entry spawned is still alive
+            if descendants > 0:
+                runner.tree_seen = now
+            elif runner.root_exited.is_set():
+                runner.tree_done.set()
+
+    async def _tick(self):
+        try:
+            await self._tick_loop()
+        finally:
+            # cancelled or failed, don't leave sessions waiting on a tree nobody scans
+            self._ticker = None
+            for runner in self.sessions:
+                if runner.tree_done is not None:
+                    runner.tree_done.set()
+
+    async def _tick_loop(self):
+        while True:
+            ended = [runner for runner in self.sessions if not runner.running]
+            for runner in ended:
+                self.sessions.remove(runner)
+
+            if len(ended) > 0:
+                self._changed()
+
+            if len(self.sessions) <= 0:
+                return
+
+            started = [runner for runner in self.sessions if runner.root_exited is not None]
+            self._show_clock(started)
+            await self._poll_processes(started)
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
@@ -0,0 +1,71 @@
+"""
+    startup.py
+
+    Copyright (C) 2019  Judah Caruso Rodriguez
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along
+    with this program; if not, write to the Free Software Foundation, Inc.,
+    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+    See NOTICE.txt for third-party license information.
+"""
+
+import sys
+import json
+import time
+
+# Import this before anything else so the first phase includes the imports.
+_STARTED = time.perf_counter()
+
+FLAG = "--profile-startup"
+
+phases = []     # (phase, seconds since _STARTED)
+
+
+def mark(phase):
+    phases.append((phase, time.perf_counter() - _STARTED))
+
+
+def elapsed():
+    return time.perf_counter() - _STARTED
+
+
+def requested(argv=None):
+    # --profile-startup prints the phases, --profile-startup=<file> writes them as json
+    argv = sys.argv[1:] if argv is None else argv
+    for arg in argv:
+        if arg == FLAG:
+            return True, None
+        if arg.startswith(FLAG + "="):
+            return True, arg[len(FLAG) + 1:]
+
+    return False, None
+
+
+def report():
+    lines = [f"{'phase':<16} {'at (ms)':>10} {'took (ms)':>10}"]
+    previous = 0
+    for phase, at in phases:
+        lines.append(f"{phase:<16} {at * 1000:>10.1f} {(at - previous) * 1000:>10.1f}")
+        previous = at
+
+    return "\n".join(lines)
+
+
+def dump(path=None):
+    if path is None:
+        print(report(), file=sys.stderr)
+        return
+
+    with open(path, "w") as fh:
+        json.dump({phase: at for phase, at in phases}, fh, indent=4)
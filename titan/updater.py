@@ -22,36 +22,39 @@
 
 import wx
 import os
-import re
 import sys
+import time
 import asyncio
-import zipfile
 import subprocess
 
-from urllib.request import urlopen, urlretrieve
-from titan.globals import VERSION, WORKING_DIR
+from titan import download
+from titan.globals import VERSION, WORKING_DIR, UPDATE_CACHE_FILE
+
+VERSION_URL = "https://raw.githubusercontent.com/kyoto-shift/titan-py/master/version.json"
+CHECK_INTERVAL = 6 * 60 * 60    # seconds between checks that touch the network
+CHECK_TIMEOUT = 10
+RELEASE_URL = "https://github.com/kyoto-shift/titan-py/releases/download"
+PROGRESS_INTERVAL = 0.25    # seconds between status bar updates
 
 
 class Updater():
-    def __init__(self, parent):
+    def __init__(self, parent, release_url=RELEASE_URL, version_url=VERSION_URL):
         self.parent = parent
+        self.version_url = version_url
+        self.release_url = release_url
+        self.last_progress = 0.0
 
     async def check_for_updates(self):
+        loop = asyncio.get_event_loop()
+        check = loop.run_in_executor(None, download.latest_version, self.version_url, UPDATE_CACHE_FILE, CHECK_INTERVAL, CHECK_TIMEOUT)
         try:
-            res = urlopen("https://raw.githubusercontent.com/kyoto-shift/titan-py/master/README.md")
-        except URLError as err:
-            print(f"Unable to retrieve file! Error: {err}")
-            return
-
-        raw_file = str(res.read())
-        rexpr = re.compile(r".*(v[0-9]{1,}.[0-9]{1,}).*")
-        matches = rexpr.match(raw_file)
-        if matches is None:
-            print("Unable to find version number from readme")
+            # the socket timeout doesn't cover name resolution, so bound the whole check too
+            latest_version = await asyncio.wait_for(check, CHECK_TIMEOUT)
+        except (OSError, ValueError, KeyError, asyncio.TimeoutError) as err:
+            print(f"Unable to check for updates! Error: {err!r}")
             return
 
-        readme_version = ("%.2f" % float(matches.group(1)[1:]))
-        if VERSION != readme_version:
+        if VERSION != latest_version:
             dialog = wx.MessageDialog(self.parent, f"There's a new update available! Would you like to update now?", "Update Available!", style=wx.YES_NO)
 
             ok = dialog.ShowModal()
@@ -59,21 +62,40 @@ class Updater():
                 dialog.Destroy()
                 return
 
-            await self._download_update(readme_version)
+            await self._download_update(latest_version)
 
         await asyncio.sleep(0.5)
 
+    def _show_progress(self, done, total):
+        # called from the download thread
+        now = time.monotonic()
+        if now - self.last_progress < PROGRESS_INTERVAL and done != total:
+            return
+
+        self.last_progress = now
+        if total:
+            msg = f"Downloading patch data... {done / total:.0%} ({done // 1024} of {total // 1024} KB)"
+        else:
+            msg = f"Downloading patch data... {done // 1024} KB"
+
+        wx.CallAfter(self.parent.SetStatusText, msg)
+
     async def _download_update(self, version):
         canonical = version.replace(".", "")
-        url = f"https://github.com/kyoto-shift/titan-py/releases/download/v{version}/titan-v{canonical}-win.zip"
+        url = f"{self.release_url}/v{version}/titan-v{canonical}-win.zip"
+        patch_zip = os.path.join(WORKING_DIR, "patch.zip")
+        loop = asyncio.get_event_loop()
 
         self.parent.SetStatusText("Downloading patch data...")
-        urlretrieve(url, os.path.join(WORKING_DIR, "patch.zip"))
-
-        self.parent.SetStatusText("Extracting patch data...")
-        with zipfile.ZipFile(os.path.join(WORKING_DIR, "patch.zip"), "r") as zip_fh:
-            zip_fh.extractall(os.path.join(WORKING_DIR, f"patch/"))
+        try:
+            sha256 = await loop.run_in_executor(None, download.read_checksum, f"{url}.sha256")
+            await loop.run_in_executor(None, download.fetch, url, patch_zip, sha256, self._show_progress)
+        except (OSError, download.ChecksumError) as err:
+            # a partial download is kept and resumed on the next attempt
+            self.parent.SetStatusText(f"Unable to download patch data! Error: {err}")
+            return
 
         self.parent.SetStatusText("Starting patch process! Titan will now close.")
-        patcher = subprocess.Popen([os.path.join(WORKING_DIR, "titan_patcher.exe"), "to_titan", version], cwd=WORKING_DIR)
+        # the patcher waits for exactly this process to exit, then applies files straight out of patch.zip
+        patcher = subprocess.Popen([os.path.join(WORKING_DIR, "titan_patcher.exe"), "to_titan", version, str(os.getpid())], cwd=WORKING_DIR)
         sys.exit(0)